@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from aiogram import Bot
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+ADMIN_CACHE_TTL = 300  # seconds
+ADMIN_STATUSES = ("administrator", "creator")
+
+class AdminCache:
+    """Кэш администраторов чатов, обновляемый целиком через get_chat_administrators"""
+
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self.admins: dict[int, set[int]] = {}
+        self.updated: dict[int, float] = {}
+        self._refreshing: dict[int, asyncio.Future] = {}
+
+    async def refresh(self, bot: Bot, chat_id: int):
+        """Загружает список администраторов чата (один запрос на всех ожидающих)"""
+        future = self._refreshing.get(chat_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(bot, chat_id))
+            self._refreshing[chat_id] = future
+            future.add_done_callback(lambda _: self._refreshing.pop(chat_id, None))
+        await asyncio.shield(future)
+
+    async def _load(self, bot: Bot, chat_id: int):
+        members = await bot.get_chat_administrators(chat_id)
+        self.admins[chat_id] = {
+            member.user.id for member in members if member.status in ADMIN_STATUSES
+        }
+        self.updated[chat_id] = time.monotonic()
+        logger.info(f"Список администраторов чата {chat_id} обновлен: {len(self.admins[chat_id])}")
+
+    async def is_admin(self, bot: Bot, chat_id, user_id: int) -> bool:
+        """Проверяет, является ли пользователь администратором или создателем чата"""
+        chat_id = int(chat_id)
+        if time.monotonic() - self.updated.get(chat_id, float("-inf")) > self.ttl:
+            await self.refresh(bot, chat_id)
+        return user_id in self.admins.get(chat_id, ())
+
+    def update_member(self, chat_id: int, user_id: int, status: str):
+        """Применяет изменение статуса участника из обновления chat_member"""
+        admins = self.admins.get(chat_id)
+        if admins is None:
+            return
+        if status in ADMIN_STATUSES:
+            admins.add(user_id)
+        else:
+            admins.discard(user_id)
+        logger.info(f"Статус участника {user_id} в чате {chat_id}: {status}")
+
+    def invalidate(self, chat_id: int):
+        """Сбрасывает кэш чата, следующий запрос загрузит список заново"""
+        self.admins.pop(chat_id, None)
+        self.updated.pop(chat_id, None)
+
+    def snapshot(self) -> dict:
+        """Списки администраторов с их возрастом в секундах"""
+        now = time.monotonic()
+        return {
+            str(chat_id): [now - self.updated[chat_id], sorted(admins)]
+            for chat_id, admins in self.admins.items() if chat_id in self.updated
+        }
+
+    def restore(self, data: dict, elapsed: float):
+        """Загружает списки из снимка; elapsed — время, прошедшее с его записи"""
+        now = time.monotonic()
+        for chat_id, (age, admins) in data.items():
+            age += elapsed
+            if age >= self.ttl:
+                continue
+            self.admins[int(chat_id)] = set(admins)
+            self.updated[int(chat_id)] = now - age
+
+admin_cache = AdminCache()
@@ -0,0 +1,168 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: меньшее значение обслуживается раньше
+PRIORITY_HIGH = 0    # ответы персонала пользователям
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2     # промежуточные подтверждения
+
+# Лимиты Telegram: (запросов в секунду, размер всплеска)
+GLOBAL_LIMIT = (30, 30)
+PRIVATE_CHAT_LIMIT = (1, 3)
+GROUP_CHAT_LIMIT = (20 / 60, 20)
+METHOD_LIMITS = {
+    "createForumTopic": (20 / 60, 5),
+    "editForumTopic": (20 / 60, 5),
+}
+MAX_RETRIES = 3
+MAX_CHAT_BUCKETS = 10_000
+
+_priority: ContextVar[int] = ContextVar("api_priority", default=PRIORITY_NORMAL)
+_sequence = itertools.count()
+
+@contextmanager
+def api_priority(priority: int):
+    """Задает приоритет для запросов к API внутри блока"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """Корзина токенов с очередью ожидающих по приоритету"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        """Корзина полна и никто не ждет — ее можно удалить"""
+        self._refill(time.monotonic())
+        return not self._waiters and self.tokens >= self.capacity
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL):
+        """Забирает токен, ожидая своей очереди"""
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and now >= self.paused_until and self.tokens >= 1:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_sequence), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже выдан — возвращаем его
+                self.tokens = min(self.capacity, self.tokens + 1)
+            raise
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (после RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+        self._schedule(reschedule=True)
+
+    def _schedule(self, reschedule: bool = False):
+        if self._timer is not None:
+            if not reschedule:
+                return
+            self._timer.cancel()
+        now = time.monotonic()
+        self._refill(now)
+        delay = max(self.paused_until - now, 0.0)
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+
+    def _release(self):
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and now >= self.paused_until and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        if self._waiters:
+            self._schedule()
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Планировщик исходящих запросов: глобальный лимит, лимиты чатов и методов, RetryAfter"""
+
+    def __init__(self, share: float = 1.0):
+        # Доля глобального лимита для этого процесса (в режиме нескольких воркеров).
+        # Лимиты чатов и методов не делятся: каждый чат обслуживает в основном один воркер
+        self.share = share
+        self.global_bucket = self._bucket(GLOBAL_LIMIT, share)
+        self.method_buckets = {name: self._bucket(limit) for name, limit in METHOD_LIMITS.items()}
+        self.chat_buckets: dict[str, TokenBucket] = {}
+
+    def _bucket(self, limit: tuple[float, float], share: float = 1.0) -> TokenBucket:
+        rate, capacity = limit
+        return TokenBucket(rate * share, max(1.0, capacity * share))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                for idle_key in [k for k, b in self.chat_buckets.items() if b.idle]:
+                    del self.chat_buckets[idle_key]
+            is_group = key.startswith("-")
+            bucket = self._bucket(GROUP_CHAT_LIMIT if is_group else PRIVATE_CHAT_LIMIT)
+            self.chat_buckets[key] = bucket
+        return bucket
+
+    def _buckets(self, method) -> list[TokenBucket]:
+        """Корзины, через которые проходит запрос (от самой узкой к глобальной)"""
+        buckets = []
+        api_method = method.__api_method__
+        if api_method in self.method_buckets:
+            buckets.append(self.method_buckets[api_method])
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None and api_method.startswith(("send", "copy", "forward", "createForumTopic", "editForumTopic")):
+            buckets.append(self._chat_bucket(chat_id))
+        buckets.append(self.global_bucket)
+        return buckets
+
+    async def __call__(self, make_request, bot, method):
+        priority = _priority.get()
+        buckets = self._buckets(method)
+        for attempt in range(MAX_RETRIES + 1):
+            for bucket in buckets:
+                await bucket.acquire(priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                logger.warning(f"Flood control на {method.__api_method__}, повтор через {e.retry_after} с")
+                # Пауза для самой узкой корзины: метода или чата, иначе глобальной
+                buckets[0].pause(e.retry_after)
@@ -0,0 +1,123 @@
+import asyncio
+import heapq
+import logging
+import time
+from database import Database, bans_db
+from metrics import ban_refresh_seconds
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+RESYNC_INTERVAL = 300  # seconds
+WATCH_INTERVAL = 1  # seconds
+
+class BanCache:
+    """Кэш банов с записью в bans.db и удалением истекших банов через кучу по ban_end"""
+
+    def __init__(self, db: Database, resync_interval: float = RESYNC_INTERVAL):
+        self.db = db
+        self.resync_interval = resync_interval
+        self.bans: dict[int, float] = {}
+        self.expiry: list[tuple[float, int]] = []
+        self.last_sync = 0.0
+        self.data_version = None
+        self.sync_task = None
+
+    def _expire(self, now: float):
+        """Удаляет истекшие баны с вершины кучи"""
+        while self.expiry and self.expiry[0][0] <= now:
+            ban_end, user_id = heapq.heappop(self.expiry)
+            # Запись в куче могла устареть после повторного бана
+            if self.bans.get(user_id) == ban_end:
+                del self.bans[user_id]
+
+    def is_banned(self, user_id: int, now: float | None = None) -> bool:
+        """Проверяет, забанен ли пользователь"""
+        self._expire(time.time() if now is None else now)
+        return user_id in self.bans
+
+    def add(self, user_id: int, ban_end: float):
+        """Добавляет бан в кэш"""
+        self.bans[user_id] = ban_end
+        heapq.heappush(self.expiry, (ban_end, user_id))
+
+    def discard(self, user_id: int):
+        """Убирает бан из кэша"""
+        self.bans.pop(user_id, None)
+
+    async def ban(self, user_id: int, ban_end: float):
+        """Сохраняет бан в базу и сразу применяет его"""
+        async with self.db.transaction() as db:
+            await db.execute(
+                '''INSERT OR REPLACE INTO ignored_users (user_id, ban_end)
+                VALUES (?, ?)''',
+                (user_id, ban_end)
+            )
+        self.add(user_id, ban_end)
+
+    async def ban_many(self, bans: list[tuple[int, float]]):
+        """Сохраняет пачку банов одной транзакцией и сразу применяет их"""
+        async with self.db.transaction() as db:
+            await db.executemany(
+                '''INSERT OR REPLACE INTO ignored_users (user_id, ban_end)
+                VALUES (?, ?)''',
+                bans
+            )
+        for user_id, ban_end in bans:
+            self.add(user_id, ban_end)
+
+    async def unban(self, user_id: int) -> bool:
+        """Удаляет бан из базы и кэша, возвращает True если бан был"""
+        async with self.db.transaction() as db:
+            cursor = await db.execute(
+                "DELETE FROM ignored_users WHERE user_id = ?",
+                (user_id,)
+            )
+        self.discard(user_id)
+        return cursor.rowcount > 0
+
+    async def resync(self):
+        """Полностью перечитывает активные баны из базы"""
+        started = time.perf_counter()
+        current_time = time.time()
+        rows = await self.db.fetchall(
+            '''SELECT user_id, ban_end FROM ignored_users
+            WHERE ban_end > ?''',
+            (current_time,)
+        )
+        self.bans = {row[0]: row[1] for row in rows}
+        self.expiry = [(ban_end, user_id) for user_id, ban_end in self.bans.items()]
+        heapq.heapify(self.expiry)
+        self.last_sync = current_time
+        ban_refresh_seconds.observe(time.perf_counter() - started)
+        logger.info(f"Кэш банов синхронизирован: {len(self.bans)}")
+
+    async def _sync_loop(self):
+        """Перечитывает баны по расписанию или сразу после записи другим процессом"""
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                data_version = await self.db.data_version()
+                changed = self.data_version is not None and data_version != self.data_version
+                self.data_version = data_version
+                if changed or time.time() - self.last_sync > self.resync_interval:
+                    await self.resync()
+            except Exception as e:
+                logger.error(f"Ошибка обновления кэша: {str(e)}")
+
+    def start(self):
+        """Запускает фоновую синхронизацию"""
+        if self.sync_task is None:
+            self.sync_task = asyncio.create_task(self._sync_loop())
+
+    async def close(self):
+        """Останавливает фоновую синхронизацию"""
+        if self.sync_task:
+            self.sync_task.cancel()
+            try:
+                await self.sync_task
+            except asyncio.CancelledError:
+                pass
+            self.sync_task = None
+
+ban_cache = BanCache(bans_db)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+from aiogram.types import Message
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+class MessageBatcher:
+    """Копит сообщения по ключу и передает их пачкой, когда новые перестают приходить"""
+
+    def __init__(self, delay: float, callback: Callable[..., Awaitable[Any]],
+                 max_wait: float | None = None, max_size: int | None = None):
+        self.delay = delay
+        self.callback = callback
+        self.max_wait = max_wait
+        self.max_size = max_size
+        self.pending: dict[Hashable, tuple[tuple, list[Message]]] = {}
+        self.started: dict[Hashable, float] = {}
+        self.timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+        # Последняя отправленная пачка по ключу, пока она обрабатывается
+        self.delivering: dict[Hashable, asyncio.Task] = {}
+
+    def add(self, key: Hashable, message: Message, *context, delay: float | None = None):
+        """Добавляет сообщение в пачку; context берется из первого сообщения пачки.
+        Пачка уходит через delay после последнего сообщения, но не позже max_wait от первого."""
+        loop = asyncio.get_running_loop()
+        if key not in self.pending:
+            self.pending[key] = (context, [])
+            self.started[key] = loop.time()
+        self.pending[key][1].append(message)
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if self.max_size is not None and len(self.pending[key][1]) >= self.max_size:
+            self._flush(key)
+            return
+        delay = self.delay if delay is None else delay
+        if self.max_wait is not None:
+            delay = max(0.0, min(delay, self.started[key] + self.max_wait - loop.time()))
+        self.timers[key] = loop.call_later(delay, self._flush, key)
+
+    def _flush(self, key: Hashable):
+        self.timers.pop(key, None)
+        self.started.pop(key, None)
+        context, messages = self.pending.pop(key, ((), []))
+        if not messages:
+            return
+        messages.sort(key=lambda message: message.message_id)
+        task = asyncio.create_task(self._deliver(messages, context))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self.delivering[key] = task
+        task.add_done_callback(lambda _: self._delivered(key, task))
+
+    def _delivered(self, key: Hashable, task: asyncio.Task):
+        if self.delivering.get(key) is task:
+            del self.delivering[key]
+
+    async def flush(self, key: Hashable):
+        """Немедленно отправляет пачку по ключу и дожидается ее обработки,
+        чтобы следующее сообщение не обогнало ее"""
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        self._flush(key)
+        task = self.delivering.get(key)
+        if task is not None:
+            await asyncio.wait({task})
+
+    async def _deliver(self, messages: list[Message], context: tuple):
+        try:
+            await self.callback(messages, *context)
+        except Exception as e:
+            logger.error(f"Ошибка обработки пачки из {len(messages)} сообщений: {str(e)}")
+
+    async def close(self):
+        """Немедленно отправляет накопленные пачки и дожидается их обработки"""
+        for key in list(self.timers):
+            self.timers[key].cancel()
+            self._flush(key)
+        if self.tasks:
+            await asyncio.wait(set(self.tasks))
+
+class Debouncer:
+    """Откладывает вызов по ключу на delay; из серии вызовов выполняется только последний"""
+
+    def __init__(self, delay: float, callback: Callable[..., Awaitable[Any]]):
+        self.delay = delay
+        self.callback = callback
+        self.pending: dict[Hashable, tuple] = {}
+        self.timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    def schedule(self, key: Hashable, *args):
+        """Планирует вызов callback(*args); более ранние аргументы для key заменяются"""
+        self.pending[key] = args
+        if key not in self.timers:
+            self.timers[key] = asyncio.get_running_loop().call_later(self.delay, self._fire, key)
+
+    def _fire(self, key: Hashable):
+        self.timers.pop(key, None)
+        args = self.pending.pop(key, None)
+        if args is None:
+            return
+        task = asyncio.create_task(self._run(args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, args: tuple):
+        try:
+            await self.callback(*args)
+        except Exception as e:
+            logger.error(f"Ошибка отложенного вызова: {str(e)}")
+
+    async def close(self):
+        """Немедленно выполняет отложенные вызовы и дожидается их"""
+        for key in list(self.timers):
+            self.timers[key].cancel()
+            self._fire(key)
+        if self.tasks:
+            await asyncio.wait(set(self.tasks))
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Бенчмарки горячих путей без сети: фейковая сессия Telegram и временные базы SQLite.
+# Запуск: python bench.py --users 10,1000,100000 --output bench_output.txt
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FORUM_CHAT_ID = -1001000000000
+BOT_ID = 42
+USER_COUNTS = (10, 1_000, 100_000)
+ITERATIONS = 2_000
+
+def prepare_workdir() -> str:
+    """Создает временный каталог с конфигурацией, data/ и logs/ и переходит в него"""
+    workdir = tempfile.mkdtemp(prefix="ticket-bot-bench-")
+    os.makedirs(os.path.join(workdir, "data"))
+    os.makedirs(os.path.join(workdir, "logs"))
+    with open(os.path.join(REPO_DIR, "data", "config.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.update({
+        "API_TOKEN": f"{BOT_ID}:BENCH",
+        "target_chat": str(FORUM_CHAT_ID),
+        "chat_mode": "multiple",
+        "reply_mode": "free",
+        "cooldown": "30m",
+        "state_timeout": "2m",
+        "coalesce_window": 0,
+    })
+    with open(os.path.join(workdir, "data", "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    return workdir
+
+def make_session():
+    """Сессия, отвечающая на методы Bot API без обращения к сети"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, ForumTopic, Message, MessageId
+
+    class FakeSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self.next_id = 1_000_000
+
+        def _next(self) -> int:
+            self.next_id += 1
+            return self.next_id
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            name = type(method).__name__
+            if name == "CreateForumTopic":
+                return ForumTopic(message_thread_id=self._next(), name=method.name, icon_color=0)
+            if name in ("CopyMessages", "ForwardMessages"):
+                return [MessageId(message_id=self._next()) for _ in method.message_ids]
+            if name == "CopyMessage":
+                return MessageId(message_id=self._next())
+            if name in ("SendMessage", "ForwardMessage"):
+                return Message(
+                    message_id=self._next(),
+                    date=0,
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=getattr(method, "text", None)
+                )
+            return True
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+    return FakeSession()
+
+def private_message(bot, user_id: int, message_id: int, text: str = "бенчмарк"):
+    from aiogram.types import Message
+    return Message.model_validate({
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"},
+        "text": text,
+    }).as_(bot)
+
+def forum_message(bot, topic_id: int, message_id: int, text: str = "ответ"):
+    from aiogram.types import Message
+    return Message.model_validate({
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": FORUM_CHAT_ID, "type": "supergroup", "is_forum": True},
+        "from": {"id": 1, "is_bot": False, "first_name": "Admin"},
+        "message_thread_id": topic_id,
+        "is_topic_message": True,
+        "text": text,
+    }).as_(bot)
+
+async def measure(name: str, users: int | None, func, iterations: int) -> dict:
+    """Замеряет задержку каждого вызова func(i) и общую пропускную способность"""
+    timings = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        begin = time.perf_counter_ns()
+        result = func(i)
+        if inspect.isawaitable(result):
+            await result
+        timings.append(time.perf_counter_ns() - begin)
+    elapsed = time.perf_counter() - started
+    return summarize(name, users, timings, elapsed)
+
+def summarize(name: str, users: int | None, timings: list[int], elapsed: float) -> dict:
+    timings = sorted(timings)
+
+    def percentile(p: float) -> float:
+        return round(timings[min(len(timings) - 1, int(len(timings) * p))] / 1000, 3)
+
+    return {
+        "name": name,
+        "users": users,
+        "iterations": len(timings),
+        "ops_per_sec": round(len(timings) / elapsed, 1) if elapsed else None,
+        "mean_us": round(statistics.fmean(timings) / 1000, 3),
+        "p50_us": percentile(0.50),
+        "p95_us": percentile(0.95),
+        "p99_us": percentile(0.99),
+        "max_us": round(timings[-1] / 1000, 3),
+    }
+
+async def reset_databases():
+    """Пересоздает базы с нуля и очищает кэши между прогонами"""
+    from database import close_databases, open_databases
+    from migrations import migrate_databases
+    from topic_cache import topic_map
+    from cooldowns import cooldowns
+    from ban_cache import ban_cache
+
+    await close_databases()
+    for name in os.listdir("data"):
+        if ".db" in name:
+            os.remove(os.path.join("data", name))
+    await open_databases()
+    await migrate_databases()
+    topic_map.by_user.clear()
+    topic_map.by_topic.clear()
+    topic_map.version = 0
+    cooldowns.last_sent.clear()
+    cooldowns.dirty.clear()
+    ban_cache.bans.clear()
+    ban_cache.expiry.clear()
+
+async def populate(users: int):
+    """Заполняет базы связями с темами и подтверждениями для users пользователей"""
+    from database import chats_db
+    from topic_cache import topic_map
+    from cooldowns import cooldowns
+
+    now = time.time()
+    async with chats_db.transaction() as db:
+        await db.executemany(
+            "INSERT INTO chats (user_id, topic_id, type, version) VALUES (?, ?, ?, ?)",
+            [(user_id, 10_000 + user_id, "report", user_id) for user_id in range(1, users + 1)]
+        )
+        await db.executemany(
+            "INSERT INTO confirmations (user_id, last_sent) VALUES (?, ?)",
+            [(user_id, now) for user_id in range(1, users + 1)]
+        )
+    await topic_map.warm()
+    cooldowns.last_sent.clear()
+
+async def bench_static(iterations: int) -> list[dict]:
+    """Бенчмарки, не зависящие от числа пользователей"""
+    from time_utils import parse_time
+    from load_config import load_config, save_config
+    import load_config as config_module
+
+    results = []
+    samples = ["30", "30m", "2h", "7d", "bad", ""]
+    results.append(await measure(
+        "parse_time", None, lambda i: parse_time(samples[i % len(samples)]), iterations * 10
+    ))
+    results.append(await measure("load_config", None, lambda i: load_config(), iterations))
+    config = load_config()
+    results.append(await measure("save_config.unchanged", None, lambda i: save_config(config), iterations))
+
+    def save_changed(i):
+        config["cooldown"] = f"{i % 50 + 1}m"
+        save_config(config)
+
+    results.append(await measure("save_config.changed", None, save_changed, iterations // 10))
+
+    def reload_config(i):
+        # Принудительная проверка файла, как после истечения CHECK_INTERVAL
+        config_module._last_check = 0.0
+        config_module.get_config()
+
+    results.append(await measure("get_config.stat", None, reload_config, iterations))
+    config["cooldown"] = "30m"
+    save_config(config)
+    return results
+
+async def bench_users(bot, users: int, iterations: int) -> list[dict]:
+    """Бенчмарки горячих путей для заданного числа пользователей"""
+    from aiogram.fsm.context import FSMContext
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.types import User
+    import handlers
+    from ban_cache import ban_cache
+    from middlewares import AsyncIgnoreMiddleware
+    from outbox import outbox
+    from storage import SQLiteStorage
+    from topic_cache import topic_map
+
+    await reset_databases()
+    await populate(users)
+    results = []
+
+    def user_of(i: int) -> int:
+        return i % users + 1
+
+    profiles = {}
+
+    def profile(user_id: int) -> User:
+        if user_id not in profiles:
+            profiles[user_id] = User(id=user_id, is_bot=False, first_name=f"U{user_id}", username=f"u{user_id}")
+        return profiles[user_id]
+
+    results.append(await measure(
+        "get_or_create_topic.cached", users,
+        lambda i: handlers.get_or_create_topic(profile(user_of(i)), "report", bot),
+        iterations
+    ))
+    created = users + 1
+    results.append(await measure(
+        "get_or_create_topic.create", users,
+        lambda i: handlers.get_or_create_topic(profile(created + i), "report", bot),
+        iterations // 4
+    ))
+
+    def rename(i):
+        # Каждый вызов меняет тип заявки, чтобы тема переименовывалась
+        user_id = user_of(i)
+        current = topic_map.peek(user_id)
+        request_type = "other" if current is None or current[1] == "report" else "report"
+        return handlers.get_or_create_topic(profile(user_id), request_type, bot)
+
+    results.append(await measure("get_or_create_topic.rename", users, rename, iterations // 4))
+    # Отложенные переименования применяются вне замера
+    await handlers.topic_renames.close()
+
+    replies = [forum_message(bot, 10_000 + user_of(i), i + 1) for i in range(iterations)]
+    results.append(await measure(
+        "forward_to_user", users,
+        lambda i: handlers.forward_to_user(10_000 + user_of(i), [replies[i]]),
+        iterations
+    ))
+    # Пересылки из очереди отправляются вне замера
+    await outbox.join()
+
+    # Решение о подтверждении из deliver_request: чтение времени подтверждения и отметка
+    def cooldown_block(i):
+        return handlers.claim_confirmation(user_of(i), handlers.get_config())
+
+    results.append(await measure("cooldown.cold", users, cooldown_block, min(iterations, users)))
+    results.append(await measure("cooldown.warm", users, cooldown_block, iterations))
+
+    requests = [private_message(bot, user_of(i), i + 1) for i in range(iterations)]
+    results.append(await measure(
+        "deliver_request", users,
+        lambda i: handlers.deliver_request([requests[i]], "report"),
+        iterations
+    ))
+    await outbox.join()
+
+    # Middleware с открытыми состояниями у всех пользователей и 1% забаненных
+    storage = SQLiteStorage()
+    keys = {}
+    for user_id in range(1, users + 1):
+        key = StorageKey(bot_id=bot.id, chat_id=user_id, user_id=user_id)
+        keys[user_id] = key
+        await storage.set_state(key, handlers.FormType.is_active)
+        await storage.set_data(key, {"type": "report", "last_activity": time.time()})
+    for user_id in range(1, users + 1, 100):
+        ban_cache.add(user_id, time.time() + 3600)
+    middleware = AsyncIgnoreMiddleware(storage=storage)
+    middleware.bot = bot
+
+    async def passthrough(event, data):
+        return None
+
+    contexts = [FSMContext(storage=storage, key=keys[user_of(i)]) for i in range(iterations)]
+    results.append(await measure(
+        "middleware.__call__", users,
+        lambda i: middleware(passthrough, requests[i], {"state": contexts[i]}),
+        iterations
+    ))
+    await middleware.close()
+
+    # Сброс по таймауту: все состояния уже истекли, замеряется время до их очистки
+    middleware = AsyncIgnoreMiddleware(storage=storage)
+    middleware.bot = bot
+    expired = time.time() - middleware.state_timeout - 1
+    started = time.perf_counter()
+    middleware.restore_states({key: expired for key in keys.values()})
+    scheduled = time.perf_counter() - started
+    while middleware.active_states:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    results.append({
+        "name": "check_states_timeout",
+        "users": users,
+        "iterations": users,
+        "ops_per_sec": round(users / elapsed, 1),
+        "schedule_ms": round(scheduled * 1000, 3),
+        "total_ms": round(elapsed * 1000, 3),
+    })
+    await middleware.close()
+    await storage.close()
+    return results
+
+async def run(user_counts, iterations: int) -> dict:
+    from aiogram import Bot
+    from database import close_databases
+    from outbox import outbox
+    import handlers
+
+    session = make_session()
+    bot = Bot(token=f"{BOT_ID}:BENCH", session=session)
+    results = []
+    try:
+        await reset_databases()
+        await outbox.start(
+            bot, handlers.RELAY_SENDERS, handlers.relay_dropped, priority_kinds=handlers.PRIORITY_RELAYS
+        )
+        results += await bench_static(iterations)
+        for users in user_counts:
+            results += await bench_users(bot, users, iterations)
+    finally:
+        await outbox.close()
+        await close_databases()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "api_calls": session.calls,
+        "results": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей бота")
+    parser.add_argument("--users", default=",".join(str(n) for n in USER_COUNTS),
+                        help="число пользователей через запятую")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--output", help="файл для JSON-результатов (по умолчанию stdout)")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = prepare_workdir()
+    try:
+        report = asyncio.run(run([int(n) for n in args.users.split(",")], args.iterations))
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import time
+from aiogram import Bot
+from aiogram.types import User
+from ban_cache import ban_cache
+from database import Database, bans_db
+from topic_cache import topic_map
+from profiles import profiles
+from admin_cache import admin_cache
+from api_scheduler import api_priority, PRIORITY_LOW
+from load_config import get_config
+from time_utils import parse_time
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+MAX_IMPORT_SIZE = 1024 * 1024  # bytes
+MAX_IMPORT_ENTRIES = 10_000
+PERMANENT_BAN = 365 * 100 * 86400  # seconds
+NOTIFY_WORKERS = 4
+
+def parse_ban_list(text: str, now: float | None = None) -> tuple[list[tuple[int, float, str]], list[str]]:
+    """Разбирает список банов: по строке "user_id [срок|-] [причина]".
+    Возвращает (баны, ошибки); срок как в /ban, "-" или пусто — навсегда."""
+    now = time.time() if now is None else now
+    bans: dict[int, tuple[int, float, str]] = {}
+    errors = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.replace(",", " ").split(maxsplit=2)
+        if not parts[0].isdigit() or int(parts[0]) <= 0:
+            errors.append(f"строка {number}: некорректный user_id {parts[0]!r}")
+            continue
+        user_id = int(parts[0])
+        duration = PERMANENT_BAN
+        if len(parts) > 1 and parts[1] != "-":
+            duration = parse_time(parts[1])
+            if duration <= 0:
+                errors.append(f"строка {number}: некорректный срок {parts[1]!r}")
+                continue
+        reason = parts[2] if len(parts) > 2 else ""
+        # Повтор пользователя в файле: действует последняя строка
+        bans[user_id] = (user_id, now + duration, reason)
+    if len(bans) > MAX_IMPORT_ENTRIES:
+        errors.append(f"слишком много записей: {len(bans)} (максимум {MAX_IMPORT_ENTRIES})")
+        return [], errors
+    return list(bans.values()), errors
+
+def ban_notification(ban_end: float, reason: str, now: float | None = None) -> str:
+    """Текст уведомления о бане, как в /ban"""
+    now = time.time() if now is None else now
+    if ban_end - now >= PERMANENT_BAN / 2:
+        return f"⛔ Вы были забанены навсегда\nПричина: {reason}"
+    ban_end_str = datetime.datetime.fromtimestamp(ban_end).strftime('%Y-%m-%d %H:%M:%S')
+    return f"⛔ Вы были временно забанены до {ban_end_str}\nПричина: {reason}"
+
+async def export_bans(db: Database = bans_db, now: float | None = None) -> str:
+    """Выгружает активные баны в формате, который принимает импорт"""
+    now = time.time() if now is None else now
+    rows = await db.fetchall(
+        "SELECT user_id, ban_end FROM ignored_users WHERE ban_end > ? ORDER BY user_id",
+        (now,)
+    )
+    lines = ["# user_id срок(секунды|-)"]
+    for user_id, ban_end in rows:
+        remaining = ban_end - now
+        lines.append(f"{user_id} -" if remaining >= PERMANENT_BAN / 2 else f"{user_id} {int(remaining)}")
+    return "\n".join(lines) + "\n"
+
+class BanNotifier:
+    """Фоновая очередь уведомлений и переименований тем после массового бана.
+    Темп задает планировщик запросов; работа идет с низким приоритетом."""
+
+    def __init__(self, workers: int = NOTIFY_WORKERS):
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.tasks: list[asyncio.Task] = []
+        self.bot: Bot | None = None
+        self.rename = None
+
+    def start(self, bot: Bot, rename):
+        """rename(user, request_type, bot) — переименование темы (get_or_create_topic)"""
+        self.bot = bot
+        self.rename = rename
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, user_id: int, ban_end: float, reason: str):
+        self.queue.put_nowait((user_id, ban_end, reason))
+
+    async def _worker(self):
+        while True:
+            user_id, ban_end, reason = await self.queue.get()
+            try:
+                with api_priority(PRIORITY_LOW):
+                    await self._process(user_id, ban_end, reason)
+            except Exception as e:
+                logger.error(f"Ошибка обработки бана {user_id}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, user_id: int, ban_end: float, reason: str):
+        try:
+            await self.bot.send_message(chat_id=user_id, text=ban_notification(ban_end, reason))
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить пользователя {user_id}: {str(e)}")
+        # Темы переименовываются только у тех, кто уже писал в бота
+        if await topic_map.get_by_user(user_id) is None:
+            return
+        user: User = await profiles.get(self.bot, user_id)
+        await self.rename(user, "banned", self.bot)
+
+    async def join(self):
+        """Дожидается обработки всей очереди"""
+        await self.queue.join()
+
+    async def close(self):
+        """Останавливает обработку; необработанные записи отбрасываются с записью в лог"""
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        dropped = 0
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            dropped += 1
+        if dropped:
+            logger.warning(f"Остановка: без уведомления и переименования темы осталось банов: {dropped}")
+
+ban_notifier = BanNotifier()
+
+async def import_bans(bans: list[tuple[int, float, str]], bot: Bot | None = None,
+                      chat_id=None, notify: bool = True) -> tuple[int, list[int]]:
+    """Записывает баны одной транзакцией и сразу применяет их в кэше.
+    С ботом и chat_id администраторы пропускаются. Возвращает (записано, пропущенные)."""
+    skipped = []
+    if bot is not None and chat_id is not None:
+        allowed = []
+        for entry in bans:
+            if await admin_cache.is_admin(bot, chat_id, entry[0]):
+                skipped.append(entry[0])
+            else:
+                allowed.append(entry)
+        bans = allowed
+    await ban_cache.ban_many([(user_id, ban_end) for user_id, ban_end, _ in bans])
+    logger.info(f"Импортировано банов: {len(bans)}, пропущено: {len(skipped)}")
+    if notify and ban_notifier.bot is not None:
+        for user_id, ban_end, reason in bans:
+            ban_notifier.enqueue(user_id, ban_end, reason)
+    return len(bans), skipped
+
+async def _cli(args):
+    from database import open_databases, close_databases
+    from migrations import verify_databases
+
+    await open_databases()
+    bot = None
+    try:
+        await verify_databases()
+        if args.command == "export":
+            text = await export_bans()
+            if args.file:
+                with open(args.file, "w", encoding="utf-8") as f:
+                    f.write(text)
+            else:
+                print(text, end="")
+            return
+
+        with open(args.file, "r", encoding="utf-8") as f:
+            bans, errors = parse_ban_list(f.read())
+        for error in errors:
+            print(f"Ошибка: {error}")
+        if errors and not args.force:
+            print("Импорт отменен, исправьте файл или используйте --force")
+            return
+        from main import create_bot
+
+        # Бот нужен и без --notify: администраторы чата не банятся
+        bot = create_bot()
+        if args.notify:
+            import handlers
+
+            ban_notifier.start(bot, handlers.get_or_create_topic)
+            count, skipped = await import_bans(bans, bot, get_config()["target_chat"])
+            await ban_notifier.join()
+            await handlers.flush_pending()
+        else:
+            count, skipped = await import_bans(bans, bot, get_config()["target_chat"], notify=False)
+        print(f"Записано банов: {count}, пропущено администраторов: {len(skipped)}")
+    finally:
+        await ban_notifier.close()
+        if bot is not None:
+            await bot.session.close()
+        await close_databases()
+
+if __name__ == "__main__":
+    from logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description="Массовый импорт и экспорт банов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="загрузить баны из файла")
+    import_parser.add_argument("file", help="строки вида: user_id [срок|-] [причина]")
+    import_parser.add_argument("--notify", action="store_true",
+                               help="уведомить пользователей и переименовать темы через бота")
+    import_parser.add_argument("--force", action="store_true", help="импортировать, пропустив ошибочные строки")
+    export_parser = subparsers.add_parser("export", help="выгрузить активные баны")
+    export_parser.add_argument("file", nargs="?", help="файл (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(_cli(args))
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from database import Database, chats_db
+from load_config import get_config
+from time_utils import parse_time
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5  # seconds
+
+class CooldownTracker:
+    """Время последних подтверждений в памяти с отложенной пакетной записью в confirmations"""
+
+    def __init__(self, db: Database, flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.last_sent: dict[int, float | None] = {}
+        self.dirty: set[int] = set()
+        self.flush_task = None
+
+    async def get(self, user_id: int) -> float | None:
+        """Возвращает время последнего подтверждения, при первом обращении читает его из базы"""
+        if user_id in self.last_sent:
+            return self.last_sent[user_id]
+        row = await self.db.fetchone(
+            "SELECT last_sent FROM confirmations WHERE user_id = ?",
+            (user_id,)
+        )
+        # Значение могло быть записано, пока шел запрос
+        return self.last_sent.setdefault(user_id, row[0] if row else None)
+
+    def mark(self, user_id: int, timestamp: float | None):
+        """Запоминает время подтверждения для последующей записи"""
+        self.last_sent[user_id] = timestamp
+        self.dirty.add(user_id)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self.dirty:
+            return
+        users, self.dirty = self.dirty, set()
+        rows = [(user_id, self.last_sent[user_id]) for user_id in users]
+        try:
+            async with self.db.transaction() as db:
+                await db.executemany(
+                    '''INSERT OR REPLACE INTO confirmations
+                    (user_id, last_sent) VALUES (?, ?)''',
+                    [row for row in rows if row[1] is not None]
+                )
+                await db.executemany(
+                    "DELETE FROM confirmations WHERE user_id = ?",
+                    [(row[0],) for row in rows if row[1] is None]
+                )
+            logger.debug(f"Записано подтверждений: {len(rows)}")
+        except Exception as e:
+            self.dirty |= users
+            logger.error(f"Ошибка записи подтверждений: {str(e)}")
+
+    def prune(self, cooldown: float, now: float | None = None):
+        """Забывает записанные в базу времена, у которых cooldown уже истек:
+        решение для них то же, что и без записи, а при необходимости они читаются из базы"""
+        now = time.time() if now is None else now
+        expired = [
+            user_id for user_id, last_sent in self.last_sent.items()
+            if user_id not in self.dirty and (last_sent is None or now - last_sent > cooldown)
+        ]
+        for user_id in expired:
+            del self.last_sent[user_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            try:
+                self.prune(parse_time(get_config()["cooldown"]))
+            except Exception as e:
+                logger.error(f"Ошибка очистки подтверждений: {str(e)}")
+
+    def start(self):
+        """Запускает периодическую запись"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Останавливает периодическую запись и сохраняет остаток"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+
+    def snapshot(self) -> list:
+        """Известные времена подтверждений: [user_id, last_sent]"""
+        return [[user_id, last_sent] for user_id, last_sent in self.last_sent.items()]
+
+    def restore(self, data: list):
+        """Загружает времена из снимка; прочитанные из базы значения не перезаписываются"""
+        for user_id, last_sent in data:
+            self.last_sent.setdefault(user_id, last_sent)
+
+cooldowns = CooldownTracker(chats_db)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+import aiosqlite
+from metrics import db_seconds
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+CHATS_DATABASE = 'data/chat_links.db'
+BANS_DATABASE = 'data/bans.db'
+FSM_DATABASE = 'data/fsm.db'
+HISTORY_DATABASE = 'data/history.db'
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+class Database:
+    """Долгоживущее соединение с базой SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.connection: aiosqlite.Connection | None = None
+        self.write_lock = asyncio.Lock()
+
+    async def open(self):
+        """Открывает соединение и применяет настройки"""
+        if self.connection is not None:
+            return
+        self.connection = await aiosqlite.connect(self.path)
+        for pragma in PRAGMAS:
+            await self.connection.execute(pragma)
+        logger.info(f"Соединение с {self.path} открыто")
+
+    async def close(self):
+        """Закрывает соединение"""
+        if self.connection is None:
+            return
+        try:
+            await self.connection.commit()
+            await self.connection.execute("PRAGMA optimize")
+        finally:
+            await self.connection.close()
+            self.connection = None
+            logger.info(f"Соединение с {self.path} закрыто")
+
+    def _require(self) -> aiosqlite.Connection:
+        if self.connection is None:
+            raise RuntimeError(f"База данных {self.path} не открыта")
+        return self.connection
+
+    async def fetchone(self, sql: str, params=()):
+        """Выполняет запрос и возвращает первую строку"""
+        started = time.perf_counter()
+        try:
+            async with self._require().execute(sql, params) as cursor:
+                return await cursor.fetchone()
+        finally:
+            db_seconds.observe(time.perf_counter() - started, database=self.name, operation="fetchone")
+
+    async def fetchall(self, sql: str, params=()):
+        """Выполняет запрос и возвращает все строки"""
+        started = time.perf_counter()
+        try:
+            async with self._require().execute(sql, params) as cursor:
+                return await cursor.fetchall()
+        finally:
+            db_seconds.observe(time.perf_counter() - started, database=self.name, operation="fetchall")
+
+    async def data_version(self) -> int:
+        """Счетчик, меняющийся после записи в базу другими соединениями (процессами)"""
+        row = await self.fetchone("PRAGMA data_version")
+        return row[0]
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Сериализованная запись: фиксирует изменения или откатывает их при ошибке"""
+        async with self.write_lock:
+            # Время считается от получения блокировки до фиксации
+            started = time.perf_counter()
+            connection = self._require()
+            try:
+                yield connection
+                await connection.commit()
+            except BaseException:
+                await connection.rollback()
+                raise
+            finally:
+                db_seconds.observe(time.perf_counter() - started, database=self.name, operation="transaction")
+
+chats_db = Database(CHATS_DATABASE)
+bans_db = Database(BANS_DATABASE)
+fsm_db = Database(FSM_DATABASE)
+history_db = Database(HISTORY_DATABASE)
+
+async def open_databases():
+    """Открывает все базы данных"""
+    await chats_db.open()
+    await bans_db.open()
+    await fsm_db.open()
+    await history_db.open()
+
+async def close_databases():
+    """Закрывает все базы данных"""
+    for db in (chats_db, bans_db, fsm_db, history_db):
+        try:
+            await db.close()
+        except Exception as e:
+            logger.error(f"Ошибка закрытия {db.path}: {str(e)}")
@@ -1,146 +1,283 @@
 import asyncio
-import aiosqlite
 import time
 import datetime
 import logging
+import html
 from aiogram.dispatcher.router import Router
-from aiogram.types import Message, User, CallbackQuery
-from load_config import load_config, save_config
+from aiogram.types import Message, User, CallbackQuery, ChatMemberUpdated, BufferedInputFile, ReplyParameters, LinkPreviewOptions
+from load_config import get_config, load_config, save_config
 from aiogram import F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandStart, StateFilter
 from buttons import *
+from ban_cache import ban_cache
+from cooldowns import cooldowns
+from topic_cache import topic_map
+from api_scheduler import api_priority, PRIORITY_HIGH, PRIORITY_LOW
+from admin_cache import admin_cache
+from profiles import profiles
+from message_map import message_map
+from outbox import DeliveryError, outbox
+from history import history, MATCH_END, MATCH_START, TO_FORUM, TO_USER
+from bulk_bans import MAX_IMPORT_SIZE, export_bans, import_bans, parse_ban_list
+from batching import Debouncer, MessageBatcher
+from time_utils import parse_time
+from metrics import tickets_total, ticket_messages_total
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-# Настройка логгера
+# Логгер модуля; вывод настраивается в logging_setup
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(f"logs/{__name__}.log", mode='a',encoding="utf-8")
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 router = Router()
-config = load_config()
-
-FORUM_CHAT_ID = int(config["target_chat"])
-
-def parse_time(time_str: str) -> int:
-    """Преобразует строку времени в секунды"""
-    if not isinstance(time_str, str):
-        return 0
-
-    if time_str.isdigit():
-        return int(time_str)
-
-    suffixes = {'m': 60, 'h': 3600, 'd': 86400}
-    if time_str[:-1].isdigit() and time_str[-1].isalpha():
-        suffix = time_str[-1].lower()
-        if suffix in suffixes:
-            return int(time_str[:-1]) * suffixes[suffix]
-    return 0
-
-async def init_chats_db():
-    """Инициализирует базу данных для хранения чатов"""
-    async with aiosqlite.connect('data/chat_links.db') as db:
-        await db.execute('''CREATE TABLE IF NOT EXISTS chats
-            (user_id INTEGER, 
-             topic_id INTEGER,
-             type TEXT)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS confirmations
-            (user_id INTEGER PRIMARY KEY,
-             last_sent REAL)''')
-        await db.commit()
-        logger.info("База данных чатов инициализирована")
+
+FORUM_CHAT_ID = int(get_config()["target_chat"])
+
+MEDIA_GROUP_DELAY = 1.0  # seconds
+MAX_COALESCE_WAIT = 10  # seconds
+TOPIC_RENAME_DELAY = 2  # seconds
+MAX_BATCH_MESSAGES = 100  # лимит copyMessages/forwardMessages
+
+# Выполняющиеся создания/переименования тем: user_id -> (request_type, future)
+_topic_flights: dict[int, tuple[str, asyncio.Future]] = {}
 
 async def get_or_create_topic(user: User, request_type: str, bot: Bot):
-    """Создает или возвращает существующую тему для пользователя"""
-    config = load_config()
+    """Создает или возвращает существующую тему для пользователя; None при ошибке"""
     try:
-        FORUM_CHAT_ID = config.get("target_chat")
-        if not FORUM_CHAT_ID:
-            logger.error("Целевой чат не настроен")
-            return None
-
-        user_id = user.id
-        async with aiosqlite.connect('data/chat_links.db') as db:
-            cursor = await db.execute(
-                "SELECT topic_id, type FROM chats WHERE user_id = ?",
-                (user_id,)
-            )
-            existing_topic = await cursor.fetchone()
-            
-            if existing_topic:
-                topic_id, current_type = existing_topic
-                if current_type != request_type:
-                    username = f"@{user.username}" if user.username else "[Нет юзернейма]"
-                    new_topic_name = f"{config["emojis"][request_type]["emoji"]} | {user.full_name} | {username}"
-                    
-                    await bot.edit_forum_topic(
-                        chat_id=FORUM_CHAT_ID,
-                        message_thread_id=topic_id,
-                        name=new_topic_name
-                    )
-                    
-                    await db.execute(
-                        "UPDATE chats SET type = ? WHERE topic_id = ?",
-                        (request_type, topic_id)
-                    )
-                    await db.commit()
-                    logger.info(f"Тема обновлена для пользователя {user_id}")
-                return topic_id
-            
-            username = f"@{user.username}" if user.username else "[Нет юзернейма]"
-            topic_name = f"{config["emojis"][request_type]["emoji"]} | {user.full_name} | {username}"
-            topic = await bot.create_forum_topic(
-                chat_id=FORUM_CHAT_ID,
-                name=topic_name
-            )
-            topic_id = topic.message_thread_id
-            await db.execute(
-                "INSERT INTO chats(user_id, topic_id, type) VALUES (?, ?, ?)",
-                (user_id, topic_id, request_type)
-            )
-            await db.commit()
-            logger.info(f"Создана новая тема для пользователя {user_id}")
-        return topic_id
+        return await ensure_topic(user, request_type, bot)
     except Exception as e:
         logger.error(f"Ошибка при создании темы: {str(e)}")
         return None
 
-async def forward_to_user(topic_id: int, message: Message):
-    """Пересылает сообщение пользователю в личные сообщения"""
-    config = load_config()
-    try:
-        async with aiosqlite.connect('data/chat_links.db') as db:
-            cursor = await db.execute(
-                "SELECT user_id FROM chats WHERE topic_id = ?",
-                (topic_id,)
+async def ensure_topic(user: User, request_type: str, bot: Bot) -> int:
+    """Создает или возвращает существующую тему для пользователя, ошибки API пробрасываются.
+    Одновременные вызовы для одного пользователя ожидают одну и ту же операцию."""
+    while True:
+        flight = _topic_flights.get(user.id)
+        if flight is None:
+            break
+        flight_type, future = flight
+        topic_id = await asyncio.shield(future)
+        if flight_type == request_type:
+            return topic_id
+
+    cached = topic_map.peek(user.id)
+    # При отложенном переименовании решение о нем принимается заново
+    if cached is not None and cached[1] == request_type and cached[0] not in topic_renames.pending:
+        return cached[0]
+
+    future = asyncio.ensure_future(_create_or_update_topic(user, request_type, bot))
+    _topic_flights[user.id] = (request_type, future)
+
+    def _release(_):
+        flight = _topic_flights.get(user.id)
+        if flight is not None and flight[1] is future:
+            del _topic_flights[user.id]
+
+    future.add_done_callback(_release)
+    return await asyncio.shield(future)
+
+def topic_name(user: User, request_type: str, config) -> str:
+    """Название темы: эмодзи типа заявки, имя и юзернейм пользователя"""
+    username = f"@{user.username}" if user.username else "[Нет юзернейма]"
+    return f"{config["emojis"][request_type]["emoji"]} | {user.full_name} | {username}"
+
+async def _create_or_update_topic(user: User, request_type: str, bot: Bot):
+    """Создает тему или переименовывает существующую под новый тип заявки"""
+    config = get_config()
+    FORUM_CHAT_ID = config.get("target_chat")
+    if not FORUM_CHAT_ID:
+        raise DeliveryError("Целевой чат не настроен")
+
+    user_id = user.id
+    existing_topic = await topic_map.get_by_user(user_id)
+    
+    if existing_topic:
+        topic_id, current_type = existing_topic
+        if current_type != request_type or topic_id in topic_renames.pending:
+            # Переименование откладывается: из быстрой серии применяется последнее.
+            # Тип сохраняется только после успешного переименования, иначе повторится позже
+            topic_renames.schedule(
+                topic_id, topic_id, user_id, request_type, topic_name(user, request_type, config), bot
             )
-            result = await cursor.fetchone()
+            logger.info(f"Тема обновлена для пользователя {user_id}")
+        return topic_id
+    
+    new_topic_name = topic_name(user, request_type, config)
+    topic = await bot.create_forum_topic(
+        chat_id=FORUM_CHAT_ID,
+        name=new_topic_name
+    )
+    topic_id = topic.message_thread_id
+    await topic_map.store(user_id, topic_id, request_type, new_topic_name)
+    logger.info(f"Создана новая тема для пользователя {user_id}")
+    return topic_id
+
+async def _rename_topic(topic_id: int, user_id: int, request_type: str, name: str, bot: Bot):
+    """Применяет итоговое название темы, если оно отличается от текущего, и сохраняет тип заявки"""
+    if name == topic_map.name_of(topic_id):
+        logger.info(f"Название темы {topic_id} не изменилось, переименование пропущено")
+    else:
+        try:
+            await bot.edit_forum_topic(
+                chat_id=get_config().get("target_chat"),
+                message_thread_id=topic_id,
+                name=name
+            )
+        except TelegramBadRequest as e:
+            if "TOPIC_NOT_MODIFIED" not in str(e):
+                raise
+        logger.info(f"Тема {topic_id} переименована", extra={"topic_id": topic_id})
+    await topic_map.store(user_id, topic_id, request_type, name)
+
+topic_renames = Debouncer(TOPIC_RENAME_DELAY, _rename_topic)
+
+async def send_batch(bot: Bot, chat_id: int, from_chat_id: int, message_ids: list[int],
+                     message_thread_id: int | None = None, forward: bool = False,
+                     reply_to: int | None = None) -> list[int]:
+    """Копирует или пересылает сообщения одного чата пачками (альбомы остаются целыми).
+    Одиночная копия отправляется ответом на reply_to. Возвращает id новых сообщений."""
+    if reply_to is not None and len(message_ids) == 1 and not forward:
+        result = await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_ids[0],
+            message_thread_id=message_thread_id,
+            reply_parameters=ReplyParameters(message_id=reply_to, allow_sending_without_reply=True)
+        )
+        return [result.message_id]
+
+    method = bot.forward_messages if forward else bot.copy_messages
+    sent = []
+    for start in range(0, len(message_ids), MAX_BATCH_MESSAGES):
+        result = await method(
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_ids=message_ids[start:start + MAX_BATCH_MESSAGES],
+            message_thread_id=message_thread_id
+        )
+        sent.extend(item.message_id for item in result)
+    return sent
+
+async def forward_to_user(topic_id: int | None, messages: list[Message]):
+    """Ставит сообщения (одно или альбом) в очередь пересылки пользователю"""
+    config = get_config()
+    message = messages[0]
+    try:
+        # Ответ на пересланное ботом сообщение однозначно указывает пользователя и сообщение
+        reply = message.reply_to_message
+        is_reply = reply is not None and reply.message_id != reply.message_thread_id
+        reply_target = await message_map.to_user(reply.message_id) if is_reply else None
+        if reply_target is not None:
+            user_id = reply_target[0]
+        else:
+            user_id = await topic_map.get_user(topic_id) if topic_id else None
         if config["reply_mode"] == "free":
             pass
 
         if config["reply_mode"] == "necessary":
             # Обязательный режим — пересылаем ТОЛЬКО если:
             # 1. Это ответ (reply_to_message не None)
-            # 2. И это ответ на сообщение бота (from_user.id == bot.id)
-            if message.reply_to_message and message.reply_to_message.from_user.id == message.bot.id and message.reply_to_message.message_id != message.reply_to_message.message_thread_id: pass
+            # 2. И это ответ на сообщение бота (from_user.id == bot.id) или на связанное сообщение
+            if reply_target is not None or (is_reply and reply.from_user.id == message.bot.id): pass
             else: return
-        if result is None:
+        if user_id is None:
             logger.warning(f"Тема {topic_id} не найдена в базе данных")
             return
         
-        user_id = result[0]
         try:
-            await message.send_copy(user_id)
-            logger.info(f"Сообщение переслано пользователю {user_id}")
+            await outbox.put("reply", f"reply:{user_id}", {
+                "user_id": user_id,
+                "topic_id": topic_id,
+                "chat_id": message.chat.id,
+                "message_ids": [item.message_id for item in messages],
+                "reply_to": reply_target[1] if reply_target and reply_target[0] == user_id else None,
+                "texts": [item.text or item.caption for item in messages],
+            }, message.chat.id)
         except Exception as e:
             logger.error(f"Ошибка пересылки: {str(e)}")
             await message.reply(f"❌ Ошибка: {str(e)}")
     except Exception as e:
         logger.error(f"Ошибка при пересылке: {str(e)}")
 
+async def send_reply(bot: Bot, job: dict):
+    """Отправляет ответ персонала из очереди пересылок пользователю"""
+    user_id = job["user_id"]
+    with api_priority(PRIORITY_HIGH):
+        sent = await send_batch(bot, user_id, job["chat_id"], job["message_ids"], reply_to=job["reply_to"])
+    message_map.link(user_id, sent, job["message_ids"], job["topic_id"])
+    history.record(TO_USER, user_id, job["topic_id"], job["texts"], job["message_ids"])
+    logger.info(
+        f"Сообщений переслано пользователю {user_id}: {len(sent)}",
+        extra={"user_id": user_id, "topic_id": job["topic_id"]}
+    )
+
+async def send_request(bot: Bot, job: dict):
+    """Отправляет заявку из очереди пересылок в форум: в одиночный чат или тему пользователя"""
+    config = get_config()
+    FORUM_CHAT_ID = config.get("target_chat")
+    user_id = job["user"]["id"]
+    request_type = job["request_type"]
+    if config.get("chat_mode") == "single":
+        target_topic = config.get("target_topic", "general")
+        topic_id = None if target_topic == "general" else int(target_topic)
+        sent = await send_batch(bot, FORUM_CHAT_ID, user_id, job["message_ids"], topic_id, forward=True)
+        # Связь нужна для ответов и бана, даже если forward_from скрыт
+        message_map.link(user_id, job["message_ids"], sent)
+        logger.info(f"Заявка переслана в одиночный чат (тема: {target_topic})")
+    else:
+        user = profiles.peek(user_id) or User(is_bot=False, **job["user"])
+        # Ошибка API при создании темы решает, повторять ли отправку
+        topic_id = await ensure_topic(user, request_type, bot)
+        reply_to = None
+        if job["reply_to"] is not None:
+            reply_to = await message_map.to_forum(user_id, job["reply_to"])
+        sent = await send_batch(bot, FORUM_CHAT_ID, user_id, job["message_ids"], topic_id, reply_to=reply_to)
+        message_map.link(user_id, job["message_ids"], sent, topic_id)
+        logger.info(f"Заявка переслана в тему {topic_id}", extra={"topic_id": topic_id})
+    history.record(TO_FORUM, user_id, topic_id, job["texts"], sent, request_type)
+    ticket_messages_total.inc(len(sent), type=request_type)
+
+async def relay_dropped(bot: Bot, kind: str, job: dict, error: Exception):
+    """Сообщает об отмененной пересылке: пользователю — о заявке, персоналу — об ответе"""
+    if kind == "request":
+        await bot.send_message(chat_id=job["user"]["id"], text="❌ Ошибка при отправке заявки")
+        return
+    await bot.send_message(
+        chat_id=job["chat_id"],
+        text=f"❌ Ошибка: {str(error)}",
+        message_thread_id=job["topic_id"],
+        reply_parameters=ReplyParameters(message_id=job["message_ids"][0], allow_sending_without_reply=True),
+        parse_mode=None
+    )
+
+# Отправители заданий очереди пересылок по их виду
+RELAY_SENDERS = {
+    "request": send_request,
+    "reply": send_reply,
+}
+# Ответы персонала обслуживаются отдельно и не ждут за заявками, упершимися в лимит форума
+PRIORITY_RELAYS = ("reply",)
+
+async def propagate_edit(message: Message, chat_id: int, message_id: int):
+    """Повторяет правку текста или подписи в связанной копии сообщения"""
+    if message.text is not None:
+        await message.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=message.text,
+            entities=message.entities,
+            parse_mode=None
+        )
+    elif message.caption is not None:
+        await message.bot.edit_message_caption(
+            chat_id=chat_id,
+            message_id=message_id,
+            caption=message.caption,
+            caption_entities=message.caption_entities,
+            parse_mode=None
+        )
+
 class FormType(StatesGroup):
     """Состояния для обработки форм"""
     is_active = State()
@@ -179,7 +316,7 @@ translations = {
 async def reset_state(call: CallbackQuery, state: FSMContext):
     """Сбрасывает текущее состояние"""
     await state.clear()
-    await call.message.answer(config["texts"]["greeting"], reply_markup=start_keyboard)
+    await call.message.answer(get_config()["texts"]["greeting"], reply_markup=start_keyboard)
     await call.answer()
     logger.info(f"Состояние сброшено для пользователя {call.from_user.id}")
 
@@ -187,19 +324,22 @@ async def reset_state(call: CallbackQuery, state: FSMContext):
 async def handle_start_buttons(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает кнопки главного меню"""
     action = callback.data.split("-")[1]
-    texts = config.get("texts")
+    texts = get_config().get("texts")
     response = texts.get(action)
     await state.set_state(None)
     await callback.answer()
     await callback.message.answer(response, reply_markup=cancel_markup)
     await state.set_state(FormType.is_active)
     await state.set_data({"type": action,"user": callback.from_user})
+    profiles.remember(callback.from_user)
+    tickets_total.inc(type=action)
     logger.info(f"Пользователь {callback.from_user.id} начал заявку типа {action}")
 
 @router.callback_query(F.data.startswith("settings"))
 async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает кнопки настроек"""
     try:
+        config = get_config()
         FORUM_CHAT_ID = config.get("target_chat")
         if not FORUM_CHAT_ID:
             await callback.answer("❌ Целевой чат не настроен! Используйте /set_chat", show_alert=True)
@@ -208,8 +348,7 @@ async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
 
         user_id = callback.from_user.id
         try:
-            chat_member = await callback.bot.get_chat_member(int(FORUM_CHAT_ID), user_id)
-            if chat_member.status not in ['administrator', 'creator']:
+            if not await admin_cache.is_admin(callback.bot, FORUM_CHAT_ID, user_id):
                 await callback.answer("❌ Только администраторы могут изменять настройки!", show_alert=True)
                 logger.warning(f"Попытка доступа к настройкам без прав: {user_id}")
                 return
@@ -261,12 +400,14 @@ async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
         elif category == "chat_mode":
             if subcategory:
                 if subcategory == "chat":
-                    config["chat_mode"] = "single"
-                    save_config(config)
+                    new_config = load_config()
+                    new_config["chat_mode"] = "single"
+                    save_config(new_config)
                     logger.info("Режим чата изменен на одиночный")
                 elif subcategory == "topic":
-                    config["chat_mode"] = "multiple"
-                    save_config(config)
+                    new_config = load_config()
+                    new_config["chat_mode"] = "multiple"
+                    save_config(new_config)
                     logger.info("Режим чата изменен на мульти-темы")
                 await callback.message.answer("Настройка успешно изменена.")
                 await callback.message.edit_text("Настройки бота:", reply_markup=settings_keyboard)
@@ -275,12 +416,14 @@ async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
         elif category == "reply_mode":
             if subcategory:
                 if subcategory == "free":
-                    config["reply_mode"] = "free"
-                    save_config(config)
+                    new_config = load_config()
+                    new_config["reply_mode"] = "free"
+                    save_config(new_config)
                     logger.info("Режим ответов изменен на свободный")
                 elif subcategory == "necessary":
-                    config["reply_mode"] = "necessary"
-                    save_config(config)
+                    new_config = load_config()
+                    new_config["reply_mode"] = "necessary"
+                    save_config(new_config)
                     logger.info("Режим ответов изменен на обязательный")
                 await callback.message.answer("Настройка успешно изменена.")
                 await callback.message.edit_text("Настройки бота:", reply_markup=settings_keyboard)
@@ -299,7 +442,6 @@ async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
         else:
             await callback.message.edit_text("Настройки бота:", reply_markup=settings_keyboard)
         
-        save_config(config)
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка обработки настроек: {str(e)}")
@@ -309,89 +451,70 @@ async def handle_settings_buttons(callback: CallbackQuery, state: FSMContext):
 async def start(msg: Message):
     """Обработчик команды /start"""
     try:
-        await msg.answer(config["texts"]["greeting"], reply_markup=start_keyboard)
+        await msg.answer(get_config()["texts"]["greeting"], reply_markup=start_keyboard)
         logger.info(f"Пользователь {msg.from_user.id} запустил бота")
     except Exception as e:
         logger.error(f"Ошибка в /start: {str(e)}")
 
-@router.message(request_filter, F.chat.type == "private")
-async def theme_choose(msg: Message, state: FSMContext):
+async def claim_confirmation(user_id: int, config: dict) -> tuple[bool, float | None]:
     """
-    Обрабатывает заявки пользователей в личных сообщениях.
+    Проверяет cooldown промежуточного сообщения и при его истечении сразу отмечает отправку,
+    чтобы параллельные сообщения не отправили второе подтверждение.
+    Возвращает (нужно ли отправить, прежнее время) — прежнее время восстанавливается при ошибке.
+    """
+    current_time = time.time()
+    last_sent = await cooldowns.get(user_id)
+    cooldown = parse_time(config["cooldown"])
+    if last_sent is None or (current_time - last_sent) > cooldown:
+        cooldowns.mark(user_id, current_time)
+        return True, last_sent
+    return False, last_sent
+
+async def deliver_request(messages: list[Message], request_type: str):
+    """
+    Ставит сообщения заявки (одно или альбом) в очередь пересылки в форум.
     Промежуточное сообщение отправляется только если с момента последнего
     такого сообщения прошло больше времени, чем указано в cooldown.
     """
+    msg = messages[0]
     try:
-        if msg.from_user.id == msg.bot.id:
-            return
-            
-        config = load_config()
+        config = get_config()
         FORUM_CHAT_ID = config.get("target_chat")
         if not FORUM_CHAT_ID:
             await msg.answer("❌ Целевой чат не настроен! Используйте /set_chat")
             logger.error("Целевой чат не настроен при обработке заявки")
             return
         
-        data = await state.get_data()
-        request_type = data["type"]
-        
-        # Обработка в зависимости от режима чата
-        if config.get("chat_mode") == "single":
-            target_topic = config.get("target_topic", "general")
-            try:
-                if target_topic == "general":
-                    await msg.forward(chat_id=FORUM_CHAT_ID)
-                else:
-                    await msg.forward(
-                        chat_id=FORUM_CHAT_ID,
-                        message_thread_id=int(target_topic)
-                    )
-                logger.info(f"Заявка переслана в одиночный чат (тема: {target_topic})")
-            except Exception as e:
-                logger.error(f"Ошибка пересылки в одиночный чат: {str(e)}")
-                await msg.answer("❌ Ошибка при отправке заявки")
-                return
-        else:
-            try:
-                topic_id = await get_or_create_topic(msg.from_user, request_type, msg.bot)
-                if topic_id is None:
-                    await msg.answer("❌ Ошибка: не удалось создать тему")
-                    return
-                    
-                await msg.send_copy(
-                    chat_id=FORUM_CHAT_ID,
-                    message_thread_id=topic_id
-                )
-                logger.info(f"Заявка переслана в тему {topic_id}")
-            except Exception as e:
-                logger.error(f"Ошибка пересылки в индивидуальную тему: {str(e)}")
-                await msg.answer("❌ Ошибка при отправке заявки")
-                return
-        
-        # Проверка cooldown для промежуточного сообщения
-        current_time = time.time()
-        async with aiosqlite.connect('data/chat_links.db') as db:
-            cursor = await db.execute(
-                "SELECT last_sent FROM confirmations WHERE user_id = ?",
-                (msg.from_user.id,)
-            )
-            last_sent = await cursor.fetchone()
+        # Заявка записывается в базу, отправку в форум (по режиму чата) выполняет очередь
+        try:
+            user = msg.from_user
+            await outbox.put("request", f"request:{user.id}", {
+                "user": {
+                    "id": user.id,
+                    "first_name": user.first_name,
+                    "last_name": user.last_name,
+                    "username": user.username,
+                },
+                "request_type": request_type,
+                "message_ids": [item.message_id for item in messages],
+                "reply_to": msg.reply_to_message.message_id if msg.reply_to_message else None,
+                "texts": [item.text or item.caption for item in messages],
+            }, msg.chat.id)
+        except Exception as e:
+            logger.error(f"Ошибка постановки заявки в очередь: {str(e)}")
+            await msg.answer("❌ Ошибка при отправке заявки")
+            return
 
-            cooldown = parse_time(config["cooldown"])
-            
-            # Отправляем сообщение только если cooldown истек или его не было
-            if not last_sent or (current_time - last_sent[0]) > cooldown:
-                try:
+        # Отправляем промежуточное сообщение только если cooldown истек или его не было
+        send_confirmation, last_sent = await claim_confirmation(msg.from_user.id, config)
+        if send_confirmation:
+            try:
+                with api_priority(PRIORITY_LOW):
                     await msg.answer(config["texts"]["confirmation"])
-                    await db.execute(
-                        '''INSERT OR REPLACE INTO confirmations 
-                        (user_id, last_sent) VALUES (?, ?)''',
-                        (msg.from_user.id, current_time)
-                    )
-                    await db.commit()
-                    logger.info(f"Подтверждение отправлено пользователю {msg.from_user.id}")
-                except Exception as e:
-                    logger.error(f"Ошибка отправки подтверждения: {str(e)}")
+                logger.info(f"Подтверждение отправлено пользователю {msg.from_user.id}")
+            except Exception as e:
+                cooldowns.mark(msg.from_user.id, last_sent)
+                logger.error(f"Ошибка отправки подтверждения: {str(e)}")
         
         # Не очищаем состояние, чтобы пользователь мог отправлять несколько сообщений
         logger.info(f"Заявка пользователя {msg.from_user.id} обработана")
@@ -400,18 +523,88 @@ async def theme_choose(msg: Message, state: FSMContext):
         logger.error(f"Ошибка обработки заявки: {str(e)}")
         await msg.answer("❌ Произошла ошибка при обработке вашей заявки")
 
+async def _forward_group_to_user(messages: list[Message], topic_id: int):
+    await forward_to_user(topic_id, messages)
+
+# Альбомы приходят отдельными сообщениями; альбомы заявок собираются по пользователю
+request_albums = MessageBatcher(MEDIA_GROUP_DELAY, deliver_request)
+# Альбомы ответов — по сотруднику, теме и media_group_id
+reply_albums = MessageBatcher(MEDIA_GROUP_DELAY, _forward_group_to_user)
+# Серии сообщений одного пользователя (включается через coalesce_window)
+request_bursts = MessageBatcher(
+    MEDIA_GROUP_DELAY, deliver_request,
+    max_wait=MAX_COALESCE_WAIT, max_size=MAX_BATCH_MESSAGES
+)
+
+async def flush_pending():
+    """Отправляет недособранные альбомы, серии сообщений и отложенные переименования"""
+    await request_bursts.close()
+    await request_albums.close()
+    await reply_albums.close()
+    await topic_renames.close()
+
+@router.message(request_filter, F.chat.type == "private")
+async def theme_choose(msg: Message, state: FSMContext):
+    """Обрабатывает заявки пользователей в личных сообщениях"""
+    try:
+        if msg.from_user.id == msg.bot.id:
+            return
+
+        data = await state.get_data()
+        request_type = data["type"]
+
+        # Объединение серии сообщений в одну пересылку (0 — выключено)
+        coalesce_window = float(get_config().get("coalesce_window", 0))
+        if coalesce_window > 0:
+            request_bursts.add((msg.from_user.id, request_type), msg, request_type, delay=coalesce_window)
+            return
+
+        if msg.media_group_id:
+            request_albums.add(msg.from_user.id, msg, request_type)
+            return
+
+        # Недособранный альбом отправляется первым, иначе сообщение обгонит его
+        await request_albums.flush(msg.from_user.id)
+        await deliver_request([msg], request_type)
+    except Exception as e:
+        logger.error(f"Ошибка обработки заявки: {str(e)}")
+        await msg.answer("❌ Произошла ошибка при обработке вашей заявки")
+
+async def _notify_user(message: Message, bot: Bot, user_id: int, text: str, action: str):
+    """Уведомляет пользователя; при ошибке сообщает об этом в тему"""
+    try:
+        await bot.send_message(chat_id=user_id, text=text)
+    except Exception as e:
+        logger.error(f"Ошибка уведомления о {action}: {str(e)}")
+        await message.reply(f"⚠ Не удалось уведомить пользователя: {str(e)}")
+
+async def _after_ban_change(message: Message, bot: Bot, user_id: int, user: User | Exception,
+                            reply_text: str, notification_text: str, request_type: str, action: str):
+    """Параллельно отвечает в теме, уведомляет пользователя и переименовывает тему"""
+    steps = [
+        bot(message.reply(reply_text)),
+        _notify_user(message, bot, user_id, notification_text, action),
+    ]
+    if isinstance(user, Exception):
+        logger.error(f"Ошибка получения профиля пользователя {user_id}: {str(user)}")
+    else:
+        steps.append(get_or_create_topic(user, request_type, bot))
+    for result in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка при {action}: {str(result)}")
+
 @router.message(Command("ban"), F.chat.id == FORUM_CHAT_ID)
 async def ban_command(message: Message, bot: Bot):
     """Бан пользователя"""
     try:
+        config = get_config()
         FORUM_CHAT_ID = config.get("target_chat")
         if not FORUM_CHAT_ID:
             await message.reply("❌ Целевой чат не настроен! Используйте /set_chat")
             return
 
         try:
-            chat_member = await bot.get_chat_member(int(FORUM_CHAT_ID), message.from_user.id)
-            if chat_member.status not in ['administrator', 'creator']:
+            if not await admin_cache.is_admin(bot, FORUM_CHAT_ID, message.from_user.id):
                 await message.reply("❌ Только администраторы могут использовать эту команду")
                 return
         except Exception as e:
@@ -419,25 +612,24 @@ async def ban_command(message: Message, bot: Bot):
             return
 
         if config.get("chat_mode") == "single":
-            if not message.reply_to_message or not message.reply_to_message.forward_from:
+            reply = message.reply_to_message
+            linked = await message_map.to_user(reply.message_id) if reply else None
+            if linked is not None:
+                user_id = linked[0]
+            elif reply and reply.forward_from:
+                user_id = reply.forward_from.id
+            else:
                 await message.reply("⚠ Ответьте на пересланное сообщение пользователя!")
                 return
-            user_id = message.reply_to_message.forward_from.id
         else:
             if not message.message_thread_id:
                 await message.reply("⚠ Эту команду можно использовать только в форумной теме!")
                 return
             
-            async with aiosqlite.connect('data/chat_links.db') as db:
-                cursor = await db.execute(
-                    "SELECT user_id FROM chats WHERE topic_id = ?",
-                    (message.message_thread_id,)
-                )
-                result = await cursor.fetchone()
-                if not result:
-                    await message.reply("❌ Тема не найдена в базе данных")
-                    return
-                user_id = result[0]
+            user_id = await topic_map.get_user(message.message_thread_id)
+            if user_id is None:
+                await message.reply("❌ Тема не найдена в базе данных")
+                return
 
         args = message.text.split()
         duration = None
@@ -462,19 +654,20 @@ async def ban_command(message: Message, bot: Bot):
         
         reason = " ".join(args[2:]) if len(args) > 2 else ""
         
-        banning_user = await bot.get_chat_member(int(FORUM_CHAT_ID), user_id)
-        if banning_user.status in ["administrator","creator"]:
+        # Проверка цели и загрузка профиля для названия темы идут параллельно
+        target_is_admin, user = await asyncio.gather(
+            admin_cache.is_admin(bot, FORUM_CHAT_ID, user_id),
+            profiles.get(bot, user_id),
+            return_exceptions=True
+        )
+        if isinstance(target_is_admin, Exception):
+            raise target_is_admin
+        if target_is_admin:
             await message.reply("Вы не можете забанить администратора бота")
             return
 
-        async with aiosqlite.connect('data/bans.db') as db:
-            await db.execute(
-                '''INSERT OR REPLACE INTO ignored_users (user_id, ban_end) 
-                VALUES (?, ?)''',
-                (user_id, timestamp)
-            )
-            await db.commit()
-            logger.info(f"Пользователь {user_id} забанен")
+        await ban_cache.ban(user_id, timestamp)
+        logger.info(f"Пользователь {user_id} забанен", extra={"user_id": user_id})
 
         reply_text = (
             f"🚫 Пользователь [ID:{user_id}] будет забанен до "
@@ -482,25 +675,9 @@ async def ban_command(message: Message, bot: Bot):
             f"{time_info}"
             f"Причина: {reason}" if reason else ""
         )
-        await message.reply(reply_text)
-
-        try:
-            notification_text = (f"⛔ Вы были временно забанены до {ban_end_str}\nПричина: {reason}" 
-                if duration else f"⛔ Вы были забанены навсегда\nПричина: {reason}")
-            await bot.send_message(user_id, text=notification_text)
-        except Exception as e:
-            logger.error(f"Ошибка уведомления о бане: {str(e)}")
-            await message.reply(f"⚠ Не удалось уведомить пользователя: {str(e)}")
-        
-        user_info = await bot.get_chat(user_id)
-        user = User(
-            id=user_id, 
-            is_bot=False, 
-            first_name=user_info.first_name, 
-            last_name=user_info.last_name, 
-            username=user_info.username
-        )
-        await get_or_create_topic(user, "banned", bot)
+        notification_text = (f"⛔ Вы были временно забанены до {ban_end_str}\nПричина: {reason}" 
+            if duration else f"⛔ Вы были забанены навсегда\nПричина: {reason}")
+        await _after_ban_change(message, bot, user_id, user, reply_text, notification_text, "banned", "бане")
     except Exception as e:
         logger.error(f"Ошибка бана пользователя: {str(e)}")
         await message.reply(f"❌ Произошла ошибка: {str(e)}")
@@ -509,14 +686,14 @@ async def ban_command(message: Message, bot: Bot):
 async def unban_command(message: Message, bot: Bot):
     """Разбан пользователя"""
     try:
+        config = get_config()
         FORUM_CHAT_ID = config.get("target_chat")
         if not FORUM_CHAT_ID:
             await message.reply("❌ Целевой чат не настроен! Используйте /set_chat")
             return
 
         try:
-            chat_member = await bot.get_chat_member(int(FORUM_CHAT_ID), message.from_user.id)
-            if chat_member.status not in ['administrator', 'creator']:
+            if not await admin_cache.is_admin(bot, FORUM_CHAT_ID, message.from_user.id):
                 await message.reply("❌ Только администраторы могут использовать эту команду")
                 return
         except Exception as e:
@@ -529,58 +706,134 @@ async def unban_command(message: Message, bot: Bot):
 
         topic_id = message.message_thread_id
 
-        async with aiosqlite.connect('data/chat_links.db') as db:
-            cursor = await db.execute(
-                "SELECT user_id FROM chats WHERE topic_id = ?",
-                (topic_id,)
-            )
-            result = await cursor.fetchone()
+        user_id = await topic_map.get_user(topic_id)
 
-        if not result:
+        if user_id is None:
             await message.reply("❌ Тема не найдена в базе данных")
             return
 
-        user_id = result[0]
-
-        async with aiosqlite.connect('data/bans.db') as db:
-            cursor = await db.execute(
-                "DELETE FROM ignored_users WHERE user_id = ?",
-                (user_id,)
-            )
-            await db.commit()
-
-        if cursor.rowcount > 0:
-            await message.reply(f"✅ Пользователь [ID:{user_id}] успешно разбанен")
-            logger.info(f"Пользователь {user_id} разбанен")
-            try:
-                await bot.send_message(
-                    chat_id=user_id,
-                    text="✅ Ваша блокировка была снята."  
-                )
-            except Exception as e:
-                logger.error(f"Ошибка уведомления о разбане: {str(e)}")
-                await message.reply(f"⚠ Не удалось уведомить пользователя: {str(e)}")
-        
-            user_info = await bot.get_chat(user_id)
-            user = User(
-                id=user_id, 
-                is_bot=False, 
-                first_name=user_info.first_name, 
-                last_name=user_info.last_name, 
-                username=user_info.username
+        # Профиль нужен только для названия темы, загружаем его вместе с разбаном
+        was_banned, user = await asyncio.gather(
+            ban_cache.unban(user_id),
+            profiles.get(bot, user_id),
+            return_exceptions=True
+        )
+        if isinstance(was_banned, Exception):
+            raise was_banned
+        if was_banned:
+            logger.info(f"Пользователь {user_id} разбанен", extra={"user_id": user_id, "topic_id": topic_id})
+            await _after_ban_change(
+                message, bot, user_id, user,
+                f"✅ Пользователь [ID:{user_id}] успешно разбанен",
+                "✅ Ваша блокировка была снята.",
+                "unbanned", "разбане"
             )
-            await get_or_create_topic(user, "unbanned", bot)
         else:
             await message.reply("ℹ Пользователь не был забанен")
     except Exception as e:
         logger.error(f"Ошибка разбана пользователя: {str(e)}")
         await message.reply(f"❌ Произошла ошибка: {str(e)}")
 
+@router.message(Command("ban_import"), F.chat.id == FORUM_CHAT_ID)
+async def ban_import_command(message: Message, bot: Bot):
+    """Массовый бан по файлу: строки вида "user_id [срок|-] [причина]" """
+    try:
+        if not await admin_cache.is_admin(bot, FORUM_CHAT_ID, message.from_user.id):
+            await message.reply("❌ Только администраторы могут использовать эту команду")
+            return
+
+        document = message.document or (message.reply_to_message and message.reply_to_message.document)
+        if not document:
+            await message.reply("⚠ Прикрепите файл со списком банов или ответьте командой на него")
+            return
+        if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+            await message.reply("⛔ Файл слишком большой")
+            return
+
+        content = await bot.download(document)
+        bans, errors = parse_ban_list(content.read().decode("utf-8", errors="replace"))
+        if errors:
+            shown = "\n".join(errors[:20])
+            more = f"\n…и еще {len(errors) - 20}" if len(errors) > 20 else ""
+            await message.reply(f"⛔ Ошибки в файле, импорт отменен:\n{shown}{more}")
+            return
+
+        count, skipped = await import_bans(bans, bot, FORUM_CHAT_ID)
+        skipped_info = f"\nПропущены администраторы: {', '.join(map(str, skipped))}" if skipped else ""
+        await message.reply(
+            f"🚫 Забанено пользователей: {count}{skipped_info}\n"
+            "Уведомления и переименование тем выполняются в фоне"
+        )
+        logger.info(f"Массовый бан: {count} пользователей")
+    except Exception as e:
+        logger.error(f"Ошибка массового бана: {str(e)}")
+        await message.reply(f"❌ Произошла ошибка: {str(e)}")
+
+@router.message(Command("ban_export"), F.chat.id == FORUM_CHAT_ID)
+async def ban_export_command(message: Message, bot: Bot):
+    """Выгрузка активных банов файлом"""
+    try:
+        if not await admin_cache.is_admin(bot, FORUM_CHAT_ID, message.from_user.id):
+            await message.reply("❌ Только администраторы могут использовать эту команду")
+            return
+
+        text = await export_bans()
+        filename = f"bans-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+        await message.reply_document(BufferedInputFile(text.encode("utf-8"), filename=filename))
+        logger.info("Выгружен список банов")
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки банов: {str(e)}")
+        await message.reply(f"❌ Произошла ошибка: {str(e)}")
+
+def message_link(chat_id: int, topic_id: int | None, message_id: int) -> str:
+    """Ссылка на сообщение в супергруппе (t.me/c/...)"""
+    internal_id = str(chat_id).removeprefix("-100")
+    if topic_id:
+        return f"https://t.me/c/{internal_id}/{topic_id}/{message_id}"
+    return f"https://t.me/c/{internal_id}/{message_id}"
+
+@router.message(Command("search"), F.chat.id == FORUM_CHAT_ID)
+async def search_command(message: Message, bot: Bot):
+    """Поиск по истории пересланных сообщений"""
+    try:
+        if not await admin_cache.is_admin(bot, FORUM_CHAT_ID, message.from_user.id):
+            await message.reply("❌ Только администраторы могут использовать эту команду")
+            return
+
+        args = message.text.split(maxsplit=1)
+        query = args[1] if len(args) > 1 else ""
+        if not query.strip():
+            await message.reply("⚠ Использование: /search <слова>")
+            return
+
+        # Недавние сообщения могут еще ждать записи
+        await history.flush()
+        started = time.perf_counter()
+        rows = await history.search(query)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not rows:
+            await message.reply(f"🔍 Ничего не найдено ({elapsed:.0f} мс)")
+            return
+
+        lines = [f"🔍 Найдено совпадений: {len(rows)} ({elapsed:.0f} мс)"]
+        for user_id, topic_id, forum_message_id, direction, created, snippet in rows:
+            date = datetime.datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M')
+            arrow = "👤" if direction == TO_FORUM else "💬"
+            snippet = html.escape(snippet).replace(MATCH_START, "<b>").replace(MATCH_END, "</b>")
+            link = message_link(FORUM_CHAT_ID, topic_id, forum_message_id)
+            lines.append(f'{arrow} <a href="{link}">{date}</a> · <code>{user_id}</code>\n{snippet}')
+        await message.reply("\n\n".join(lines), link_preview_options=LinkPreviewOptions(is_disabled=True))
+        logger.info(f"Поиск по истории: {len(rows)} совпадений за {elapsed:.1f} мс")
+    except Exception as e:
+        logger.error(f"Ошибка поиска по истории: {str(e)}")
+        await message.reply(f"❌ Произошла ошибка: {str(e)}")
+
 @router.message(settings_filter)
 async def change_setting(msg: Message, state: FSMContext):
     """Изменяет настройки бота"""
     try:
         data = await state.get_data()
+        config = load_config()
         
         if data.get("setting_type") == "confirmation_cooldown":
             new_cooldown = msg.text
@@ -650,13 +903,12 @@ async def set_topic(msg: Message):
 async def settings(msg: Message, state: FSMContext):
     """Открывает меню настроек"""
     try:
-        FORUM_CHAT_ID = config.get("target_chat")
+        FORUM_CHAT_ID = get_config().get("target_chat")
         if not FORUM_CHAT_ID:
             await msg.answer("❌ Целевой чат не настроен! Используйте /set_chat")
             return
 
-        user = await msg.bot.get_chat_member(int(FORUM_CHAT_ID), msg.from_user.id)
-        if user.status in ["administrator","creator"]:
+        if await admin_cache.is_admin(msg.bot, FORUM_CHAT_ID, msg.from_user.id):
             await msg.answer("Настройки бота:", reply_markup=settings_keyboard)
             logger.info(f"Пользователь {msg.from_user.id} открыл настройки")
     except Exception as e:
@@ -673,32 +925,83 @@ async def help_command(message: Message):
         "/set_topic - Установить тему для одиночного режима\n"
         "/ban (время(опционально)) (причина(опционально)) - Забанить пользователя\n"
         "/unban - Разбанить пользователя\n"
+        "/ban_import - Массовый бан по прикрепленному файлу\n"
+        "/ban_export - Выгрузить список банов\n"
+        "/search <слова> - Поиск по истории заявок\n"
         "/help - Показать это сообщение\n"
     )
     await message.answer(help_text)
     logger.info("Отправлена справка по командам")
 
+@router.chat_member(F.chat.id == FORUM_CHAT_ID)
+async def handle_chat_member(event: ChatMemberUpdated):
+    """Обновляет кэш администраторов при изменении статуса участника"""
+    admin_cache.update_member(event.chat.id, event.new_chat_member.user.id, event.new_chat_member.status)
+
 @router.message(F.chat.id == FORUM_CHAT_ID)
 async def handle_forum_message(message: Message):
     """Обрабатывает сообщения в форумном чате"""
-    config = load_config()
+    config = get_config()
     try:
         FORUM_CHAT_ID = config.get("target_chat")
         if not FORUM_CHAT_ID or message.chat.id != int(FORUM_CHAT_ID):
             return
         
-        if not message.message_thread_id or message.from_user.id == message.bot.id:
+        if message.from_user.id == message.bot.id:
+            return
+        # Вне тем пересылаются только ответы на связанные сообщения (одиночный режим)
+        if not message.message_thread_id and not message.reply_to_message:
             return
 
-        
-        await forward_to_user(message.message_thread_id, message)
+        if message.media_group_id:
+            reply_albums.add(
+                (message.from_user.id, message.message_thread_id, message.media_group_id),
+                message,
+                message.message_thread_id
+            )
+            return
+
+        # Недособранные альбомы этого сотрудника отправляются первыми, иначе ответ обгонит их
+        staff_id = message.from_user.id
+        for key in {*reply_albums.pending, *reply_albums.delivering}:
+            if key[0] == staff_id:
+                await reply_albums.flush(key)
+        await forward_to_user(message.message_thread_id, [message])
     except Exception as e:
                 logger.error(f"Ошибка обработки форумного сообщения: {str(e)}")
 
+@router.edited_message(F.chat.type == "private")
+async def handle_private_edit(message: Message):
+    """Переносит правку сообщения заявки в копию в форуме"""
+    try:
+        if ban_cache.is_banned(message.from_user.id) or get_config().get("chat_mode") == "single":
+            # Пересланные сообщения изменить нельзя
+            return
+        forum_message_id = await message_map.to_forum(message.from_user.id, message.message_id)
+        if forum_message_id is None:
+            return
+        await propagate_edit(message, FORUM_CHAT_ID, forum_message_id)
+        logger.info("Правка сообщения перенесена в форум", extra={"user_id": message.from_user.id})
+    except Exception as e:
+        logger.error(f"Ошибка переноса правки в форум: {str(e)}")
+
+@router.edited_message(F.chat.id == FORUM_CHAT_ID)
+async def handle_forum_edit(message: Message):
+    """Переносит правку ответа персонала в копию у пользователя"""
+    try:
+        linked = await message_map.to_user(message.message_id)
+        if linked is None:
+            return
+        user_id, user_message_id = linked
+        await propagate_edit(message, user_id, user_message_id)
+        logger.info(f"Правка ответа перенесена пользователю {user_id}", extra={"user_id": user_id})
+    except Exception as e:
+        logger.error(f"Ошибка переноса правки пользователю: {str(e)}")
+
 @router.message(F.chat.type == "private")
 async def handle_private_message(message: Message):
     """Обрабатывает личные сообщения"""
     try:
-        await message.answer(config["texts"]["greeting"], reply_markup=start_keyboard)
+        await message.answer(get_config()["texts"]["greeting"], reply_markup=start_keyboard)
     except Exception as e:
         logger.error(f"Ошибка обработки личного сообщения: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from database import Database, history_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1  # seconds
+SEARCH_LIMIT = 10
+SNIPPET_TOKENS = 12
+# Маркеры совпадений во фрагменте; заменяются на разметку после экранирования текста
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+TO_FORUM = "in"
+TO_USER = "out"
+
+def build_query(text: str) -> str:
+    """Превращает ввод персонала в запрос FTS5: все слова обязательны, последнее — префикс.
+    Кавычки экранируются, поэтому операторы FTS5 из ввода не интерпретируются."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return ""
+    terms[-1] += "*"
+    return " ".join(terms)
+
+class TicketHistory:
+    """Текст пересланных сообщений с полнотекстовым индексом.
+    Записи копятся в памяти и сохраняются пачками в фоне."""
+
+    def __init__(self, db: Database, flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.pending: list[tuple] = []
+        self.flush_task = None
+
+    def record(self, direction: str, user_id: int, topic_id: int | None,
+               texts: list[str | None], forum_message_ids: list[int], request_type: str | None = None):
+        """Запоминает текст или подписи сообщений; forum_message_ids — их id в форуме"""
+        now = time.time()
+        for text, forum_message_id in zip(texts, forum_message_ids):
+            if not text:
+                continue
+            self.pending.append((now, direction, user_id, topic_id, forum_message_id, request_type, text))
+
+    async def flush(self):
+        """Записывает накопленные сообщения одной транзакцией"""
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            async with self.db.transaction() as db:
+                await db.executemany(
+                    '''INSERT INTO history
+                    (created, direction, user_id, topic_id, forum_message_id, request_type, text)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    rows
+                )
+        except Exception as e:
+            self.pending = rows + self.pending
+            logger.error(f"Ошибка записи истории: {str(e)}")
+
+    async def search(self, text: str, limit: int = SEARCH_LIMIT) -> list[tuple]:
+        """Лучшие совпадения по bm25: (user_id, topic_id, forum_message_id, direction, created, фрагмент)"""
+        query = build_query(text)
+        if not query:
+            return []
+        return await self.db.fetchall(
+            f'''SELECT h.user_id, h.topic_id, h.forum_message_id, h.direction, h.created,
+                snippet(history_fts, 0, ?, ?, '…', {SNIPPET_TOKENS})
+            FROM history_fts JOIN history h ON h.id = history_fts.rowid
+            WHERE history_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?''',
+            (MATCH_START, MATCH_END, query, limit)
+        )
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Запускает периодическую запись"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Останавливает периодическую запись и сохраняет остаток"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+
+history = TicketHistory(history_db)
@@ -1,32 +1,100 @@
 import json
 import logging
+import os
+import time
+from types import MappingProxyType
+from typing import Any, Mapping
 
-# Настройка логгера
+# Логгер модуля; вывод настраивается в logging_setup
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(f"logs/{__name__}.log", mode='a',encoding="utf-8")
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
-def load_config() -> dict:
-    """Загружает конфигурацию из файла"""
+CONFIG_PATH = "data/config.json"
+CHECK_INTERVAL = 1.0  # seconds
+
+# Текущий снимок конфигурации и его версия
+_snapshot: Mapping[str, Any] = MappingProxyType({})
+_version = 0
+_file_id = None
+_last_check = 0.0
+
+def _freeze(value):
+    """Рекурсивно превращает конфигурацию в неизменяемую структуру"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def _thaw(value):
+    """Возвращает изменяемую копию неизменяемой конфигурации"""
+    if isinstance(value, Mapping):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw(v) for v in value]
+    return value
+
+def _stat_config():
+    """Возвращает идентификатор версии файла (inode, mtime, размер)"""
+    try:
+        st = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _read_config():
+    """Читает конфигурацию с диска"""
     try:
-        with open("data/config.json", "r", encoding="utf-8") as f:
-            config = json.load(f)
-            return config
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
     except FileNotFoundError:
         logger.error("Файл конфигурации не найден")
         return {}
     except json.JSONDecodeError:
         logger.error("Ошибка декодирования конфигурации")
-        return {}
+        return None
+
+def _publish(config, file_id):
+    """Публикует новый снимок конфигурации"""
+    global _snapshot, _version, _file_id
+    _snapshot = _freeze(config)
+    _file_id = file_id
+    _version += 1
+    logger.info(f"Загружена конфигурация версии {_version}")
+
+def get_config() -> Mapping[str, Any]:
+    """Возвращает неизменяемый снимок конфигурации из памяти.
+    Файл перечитывается только если изменились его inode или mtime."""
+    global _last_check
+    now = time.monotonic()
+    if _version == 0 or now - _last_check >= CHECK_INTERVAL:
+        _last_check = now
+        file_id = _stat_config()
+        if file_id != _file_id:
+            config = _read_config()
+            if config is not None:
+                _publish(config, file_id)
+    return _snapshot
+
+def config_version() -> int:
+    """Возвращает номер версии текущего снимка конфигурации"""
+    get_config()
+    return _version
+
+def load_config() -> dict:
+    """Возвращает изменяемую копию конфигурации"""
+    return _thaw(get_config())
 
 def save_config(config):
     """Сохраняет конфигурацию в файл"""
+    config = _thaw(config)
+    if config == _thaw(get_config()):
+        return
     try:
-        with open("data/config.json", "w", encoding="utf-8") as f:
+        tmp_path = f"{CONFIG_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(config, f, ensure_ascii=False, indent=4)
-            logger.info("Конфигурация сохранена")
+        os.replace(tmp_path, CONFIG_PATH)
+        _publish(config, _stat_config())
+        logger.info("Конфигурация сохранена")
     except Exception as e:
-        logger.error(f"Ошибка сохранения конфигурации: {str(e)}")
\ No newline at end of file
+        logger.error(f"Ошибка сохранения конфигурации: {str(e)}")
@@ -0,0 +1,136 @@
+import atexit
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_DIR = "logs"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+CONTEXT_FIELDS = ("user_id", "topic_id")
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Поля, добавляемые ко всем записям внутри текущей задачи (user_id, topic_id)
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+_listener: QueueListener | None = None
+
+@contextmanager
+def log_context(**fields):
+    """Добавляет поля к записям лога, сделанным внутри блока"""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+class ContextFilter(logging.Filter):
+    """Копирует поля контекста в запись, если они не переданы явно через extra"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class CompressedRotatingFileHandler(RotatingFileHandler):
+    """Ротация по размеру со сжатием старых файлов в gzip"""
+
+    def __init__(self, filename: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+class ModuleFileHandler(logging.Handler):
+    """Пишет записи в logs/<модуль>.log, как раньше делали обработчики модулей"""
+
+    def __init__(self, directory: str = LOG_DIR):
+        super().__init__()
+        self.directory = directory
+        self.files: dict[str, CompressedRotatingFileHandler] = {}
+
+    def _file(self, name: str) -> CompressedRotatingFileHandler:
+        module = name.split(".")[0]
+        handler = self.files.get(module)
+        if handler is None:
+            handler = CompressedRotatingFileHandler(os.path.join(self.directory, f"{module}.log"))
+            handler.setFormatter(self.formatter)
+            self.files[module] = handler
+        return handler
+
+    def emit(self, record: logging.LogRecord):
+        self._file(record.name).handle(record)
+
+    def close(self):
+        for handler in self.files.values():
+            handler.close()
+        super().close()
+
+def setup_logging(log_queue=None, level: int = logging.INFO):
+    """Направляет все записи в очередь, которую разбирает фоновый поток.
+    log_queue можно передать процессам-воркерам, чтобы писал только один процесс."""
+    global _listener
+    os.makedirs(LOG_DIR, exist_ok=True)
+    if log_queue is None:
+        log_queue = queue.SimpleQueue()
+
+    files = ModuleFileHandler()
+    files.setFormatter(JsonFormatter())
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    _listener = QueueListener(log_queue, files, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    attach_queue(log_queue, level)
+    return log_queue
+
+def attach_queue(log_queue, level: int = logging.INFO):
+    """Подключает корневой логгер к очереди (в воркерах — к очереди супервизора)"""
+    handler = QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
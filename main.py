@@ -1,72 +1,311 @@
 import asyncio
+import json
 import logging
+import multiprocessing
+import signal
 from aiogram import Bot, Dispatcher
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums.parse_mode import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 import handlers
-from load_config import load_config
+from load_config import get_config
 from middlewares import AsyncIgnoreMiddleware
-import aiosqlite
+from database import open_databases, close_databases
+from migrations import migrate_databases, verify_databases
+from topic_cache import topic_map
+from api_scheduler import RateLimitMiddleware
+from cooldowns import cooldowns
+from message_map import message_map
+from history import history
+from outbox import outbox
+from snapshot import restore_snapshot, save_snapshot, snapshot_path
+from ban_cache import ban_cache
+from storage import SQLiteStorage
+from bulk_bans import ban_notifier
+from webhook import run_webhook, webhook_settings
+from sharding import shard_key, shard_of
+import metrics
+from logging_setup import attach_queue, setup_logging
+from metrics import APIMetricsMiddleware, HandlerMetricsMiddleware, metrics_settings, start_metrics_server
 from aiogram.client.default import DefaultBotProperties
 
-# Настройка логгера
+# Логгер модуля; вывод настраивается в logging_setup
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(f"logs/{__name__}.log", mode='a',encoding='utf-8')
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
-session = AiohttpSession()
+POLL_TIMEOUT = 30  # seconds
+WORKER_STOP_TIMEOUT = 60  # seconds
+MAX_WORKER_RESTARTS = 5
+
+def create_bot(share: float = 1.0) -> Bot:
+    """Создает бота; все исходящие запросы проходят через планировщик с лимитами"""
+    bot = Bot(
+        token=get_config()["API_TOKEN"],
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        session=AiohttpSession()
+    )
+    bot.session.middleware(RateLimitMiddleware(share=share))
+    bot.session.middleware(APIMetricsMiddleware())
+    return bot
+
+async def setup_bot(worker: int = 0, workers: int = 1):
+    """Открывает базы, загружает кэши и собирает бота, диспетчер и middleware.
+    В режиме нескольких воркеров загружаются только состояния своей доли чатов."""
+    # Открытие постоянных соединений с базами данных
+    await open_databases()
+    await verify_databases()
+
+    bot = create_bot(share=1 / workers)
+
+    # Кэши прошлого запуска; без снимка кэш связей пользователь ↔ тема прогревается из базы
+    if not await restore_snapshot(snapshot_path(worker), bot.id):
+        await topic_map.warm()
+    topic_map.start()
+
+    # Периодическая запись времени подтверждений и связей сообщений
+    cooldowns.start()
+    await message_map.start()
+    history.start()
+
+    # Загрузка банов и фоновая синхронизация кэша
+    await ban_cache.resync()
+    ban_cache.start()
+
+    # Фоновые уведомления и переименования после массового бана
+    ban_notifier.start(bot, handlers.get_or_create_topic)
+    # Отправка пересылок из очереди, включая оставшиеся с прошлого запуска
+    await outbox.start(
+        bot, handlers.RELAY_SENDERS, handlers.relay_dropped,
+        lambda chat_id: shard_of(chat_id, workers) == worker,
+        handlers.PRIORITY_RELAYS
+    )
+
+    # Восстановление состояний FSM из базы
+    storage = SQLiteStorage()
+    await storage.load(lambda key: shard_of(key.chat_id, workers) == worker)
+    storage.start()
+    dp = Dispatcher(storage=storage)
+
+    # Подключение middleware
+    middleware = AsyncIgnoreMiddleware(storage=dp.storage)
+    middleware.bot = bot
+    middleware.restore_states(storage.last_activity())
+    dp.message.middleware(middleware)
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+    dp.chat_member.middleware(HandlerMetricsMiddleware("chat_member"))
+    dp.include_router(handlers.router)
+
+    metrics.active_states.set_function(lambda: len(middleware.active_states))
+    metrics.ban_cache_size.set_function(lambda: len(ban_cache.bans))
+    metrics.topic_cache_hits.set_function(lambda: topic_map.stats()["hits"])
+    metrics.topic_cache_misses.set_function(lambda: topic_map.stats()["misses"])
+    metrics.topic_cache_size.set_function(lambda: topic_map.stats()["users"])
+    return bot, dp, middleware
+
+async def shutdown_bot(bot, dp, middleware, worker: int = 0):
+    """Останавливает фоновые задачи, сохраняет состояние и закрывает соединения"""
+    await ban_notifier.close()
+    await handlers.flush_pending()
+    await outbox.close()
+    if middleware is not None:
+        await middleware.close()
+    if dp is not None:
+        # Снимок кэшей для быстрого старта; базы еще открыты
+        await save_snapshot(snapshot_path(worker), bot.id)
+    await cooldowns.close()
+    await message_map.close()
+    await history.close()
+    await ban_cache.close()
+    await topic_map.close()
+    if dp is not None:
+        await dp.storage.close()
+    if bot is not None:
+        await bot.session.close()
+        logger.info("Сессия бота закрыта")
+    await close_databases()
 
 async def main():
     """Основная функция инициализации бота"""
+    bot = dp = middleware = metrics_runner = None
     try:
-        # Инициализация баз данных
-        await handlers.init_chats_db()
-        
-        # Инициализация базы банов
-        async with aiosqlite.connect('data/bans.db') as db:
-            await db.execute('''CREATE TABLE IF NOT EXISTS ignored_users (
-                user_id INTEGER PRIMARY KEY,
-                ban_end REAL NOT NULL
-            )''')
-            await db.execute('CREATE INDEX IF NOT EXISTS idx_ban_end ON ignored_users(ban_end)')
-            await db.commit()
-            logger.info("База данных банов инициализирована")
-
-        bot = Bot(
-            token=load_config()["API_TOKEN"], 
-            default=DefaultBotProperties(parse_mode=ParseMode.HTML), 
-            session=session
-        )
-        dp = Dispatcher(storage=MemoryStorage())
-        
-        # Подключение middleware
-        dp.message.middleware(AsyncIgnoreMiddleware(storage=dp.storage))
-        dp.include_router(handlers.router)
-        
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("Бот запущен")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        # Обновление и проверка схем баз данных
+        await open_databases()
+        await migrate_databases()
+
+        bot, dp, middleware = await setup_bot()
+
+        config = get_config()
+        settings = metrics_settings(config)
+        if settings["enabled"]:
+            metrics_runner = await start_metrics_server(settings)
+        if config.get("update_mode") == "webhook":
+            logger.info("Бот запущен в режиме вебхука")
+            await run_webhook(bot, dp, webhook_settings(config))
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Бот запущен")
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.critical(f"Критическая ошибка при запуске: {str(e)}")
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await shutdown_bot(bot, dp, middleware)
 
-if __name__ == "__main__":
-    # Настройка корневого логгера
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler("logs/bot.log",encoding='utf-8'),
-            logging.StreamHandler()
-        ],
-        
-    )
-    
+async def worker(index: int, workers: int, queue):
+    """Обрабатывает обновления своей доли чатов, получаемые от процесса приема"""
+    bot = dp = middleware = metrics_runner = None
+    tasks = set()
     try:
-        asyncio.run(main())
+        bot, dp, middleware = await setup_bot(index, workers)
+        settings = metrics_settings(get_config())
+        if settings["enabled"]:
+            # У каждого воркера свой порт: port + index
+            metrics_runner = await start_metrics_server(settings, port_offset=index)
+        logger.info(f"Воркер {index} запущен")
+        loop = asyncio.get_running_loop()
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, json.loads(raw)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=WORKER_STOP_TIMEOUT)
+    except Exception as e:
+        logger.critical(f"Критическая ошибка воркера {index}: {str(e)}")
     finally:
-        session.close()
-        logger.info("Сессия бота закрыта")
\ No newline at end of file
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await shutdown_bot(bot, dp, middleware, index)
+        logger.info(f"Воркер {index} остановлен")
+
+def run_worker(index: int, workers: int, queue, log_queue):
+    """Точка входа процесса-воркера"""
+    # Записи передаются супервизору, файлы пишет только он
+    attach_queue(log_queue)
+    # Остановкой воркеров управляет супервизор через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker(index, workers, queue))
+
+async def ingest(queues, check_workers=None):
+    """Получает обновления и раздает их воркерам по id чата.
+    check_workers() вызывается перед каждым запросом: пока воркер не работает,
+    полученные обновления не подтверждаются."""
+    bot = create_bot()
+    dp = Dispatcher()
+    dp.include_router(handlers.router)
+    allowed_updates = dp.resolve_used_update_types()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    offset = None
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        logger.info(f"Прием обновлений запущен, воркеров: {len(queues)}")
+        stopped = asyncio.ensure_future(stop.wait())
+        while not stop.is_set():
+            # Запрос с новым offset подтверждает уже разданные обновления
+            if check_workers is not None and not check_workers():
+                raise RuntimeError("Воркер не запускается, прием обновлений остановлен")
+            polling = asyncio.ensure_future(bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates
+            ))
+            await asyncio.wait({polling, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if not polling.done():
+                polling.cancel()
+                break
+            try:
+                updates = polling.result()
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                queue = queues[shard_of(shard_key(update), len(queues))]
+                queue.put(update.model_dump_json(by_alias=True, exclude_unset=True))
+    finally:
+        await bot.session.close()
+        logger.info("Прием обновлений остановлен")
+
+async def prepare_databases():
+    """Обновляет схемы баз один раз до запуска воркеров"""
+    try:
+        await open_databases()
+        await migrate_databases()
+        await verify_databases()
+    finally:
+        await close_databases()
+
+def run_supervisor(workers: int):
+    """Запускает воркеры и процесс приема обновлений"""
+    # Процесс приема распределяет обновления только из long polling
+    if get_config().get("update_mode") == "webhook":
+        raise ValueError("Режим вебхука не поддерживается при workers > 1, используйте polling или workers = 1")
+    context = multiprocessing.get_context("spawn")
+    log_queue = configure_logging(context.Queue())
+    asyncio.run(prepare_databases())
+    queues = [context.Queue() for _ in range(workers)]
+
+    def start_worker(index: int):
+        process = context.Process(
+            target=run_worker,
+            args=(index, workers, queues[index], log_queue),
+            name=f"worker-{index}"
+        )
+        process.start()
+        return process
+
+    processes = [start_worker(index) for index in range(workers)]
+    restarts = [0] * workers
+
+    def check_workers() -> bool:
+        """Перезапускает завершившиеся воркеры; False, если воркер падает слишком часто.
+        Обновления из очереди упавшего воркера получит перезапущенный."""
+        for index, process in enumerate(processes):
+            if process.is_alive():
+                continue
+            if restarts[index] >= MAX_WORKER_RESTARTS:
+                logger.critical(f"Воркер {index} завершился после {restarts[index]} перезапусков")
+                return False
+            restarts[index] += 1
+            logger.error(f"Воркер {index} завершился (код {process.exitcode}), перезапуск")
+            processes[index] = start_worker(index)
+        return True
+
+    failed = False
+    try:
+        asyncio.run(ingest(queues, check_workers))
+    except Exception as e:
+        failed = True
+        logger.critical(f"Критическая ошибка приема обновлений: {str(e)}")
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не остановился, завершаем")
+                process.terminate()
+    if failed:
+        raise SystemExit(1)
+
+def configure_logging(log_queue=None):
+    """Настройка корневого логгера: запись через очередь в фоновом потоке"""
+    return setup_logging(log_queue)
+
+if __name__ == "__main__":
+    workers = int(get_config().get("workers", 1))
+    if workers > 1:
+        run_supervisor(workers)
+    else:
+        configure_logging()
+        asyncio.run(main())
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from database import Database, chats_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+MESSAGE_CACHE_SIZE = 100_000
+FLUSH_INTERVAL = 1  # seconds
+LINK_TTL = 30 * 86400  # seconds
+PRUNE_INTERVAL = 3600  # seconds
+MISS_TTL = 60  # seconds
+MISS_CACHE_SIZE = 10_000
+
+class MessageMap:
+    """Связи сообщений: (user_id, id в ЛС) ↔ id в форуме.
+    Кэш LRU в памяти, новые связи записываются в message_links пачками."""
+
+    def __init__(self, db: Database, capacity: int = MESSAGE_CACHE_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.by_forum: OrderedDict[int, tuple[int, int]] = OrderedDict()
+        self.by_user: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self.pending: list[tuple[int, int, int, int | None, float]] = []
+        # Сообщения форума без связи (ответы персонала друг другу, служебные): id -> время проверки
+        self.missing: OrderedDict[int, float] = OrderedDict()
+        self.flush_task = None
+
+    def _remember(self, user_id: int, user_message_id: int, forum_message_id: int):
+        self.missing.pop(forum_message_id, None)
+        self.by_forum[forum_message_id] = (user_id, user_message_id)
+        self.by_forum.move_to_end(forum_message_id)
+        self.by_user[(user_id, user_message_id)] = forum_message_id
+        self.by_user.move_to_end((user_id, user_message_id))
+        while len(self.by_forum) > self.capacity:
+            self.by_forum.popitem(last=False)
+        while len(self.by_user) > self.capacity:
+            self.by_user.popitem(last=False)
+
+    def link(self, user_id: int, user_message_ids: list[int], forum_message_ids: list[int],
+             topic_id: int | None = None):
+        """Запоминает пары сообщений после пересылки в любую сторону"""
+        if len(user_message_ids) != len(forum_message_ids):
+            # Telegram пропускает сообщения, которые нельзя скопировать, — пары не восстановить
+            logger.warning(f"Не удалось связать сообщения пользователя {user_id}: "
+                           f"{len(user_message_ids)} ≠ {len(forum_message_ids)}")
+            return
+        now = time.time()
+        for user_message_id, forum_message_id in zip(user_message_ids, forum_message_ids):
+            self._remember(user_id, user_message_id, forum_message_id)
+            self.pending.append((user_id, user_message_id, forum_message_id, topic_id, now))
+
+    async def to_user(self, forum_message_id: int) -> tuple[int, int] | None:
+        """(user_id, id в ЛС) для сообщения форума"""
+        cached = self.by_forum.get(forum_message_id)
+        if cached is not None:
+            self.by_forum.move_to_end(forum_message_id)
+            return cached
+        checked = self.missing.get(forum_message_id)
+        if checked is not None and time.monotonic() - checked < MISS_TTL:
+            return None
+        row = await self.db.fetchone(
+            "SELECT user_id, user_message_id FROM message_links WHERE forum_message_id = ?",
+            (forum_message_id,)
+        )
+        if row is None:
+            # Связь могла появиться, пока шел запрос
+            if forum_message_id not in self.by_forum:
+                self.missing[forum_message_id] = time.monotonic()
+                self.missing.move_to_end(forum_message_id)
+                while len(self.missing) > MISS_CACHE_SIZE:
+                    self.missing.popitem(last=False)
+            return None
+        self._remember(row[0], row[1], forum_message_id)
+        return row[0], row[1]
+
+    async def to_forum(self, user_id: int, user_message_id: int) -> int | None:
+        """id в форуме для сообщения из ЛС пользователя"""
+        cached = self.by_user.get((user_id, user_message_id))
+        if cached is not None:
+            self.by_user.move_to_end((user_id, user_message_id))
+            return cached
+        row = await self.db.fetchone(
+            '''SELECT forum_message_id FROM message_links
+            WHERE user_id = ? AND user_message_id = ?''',
+            (user_id, user_message_id)
+        )
+        if row is None:
+            return None
+        self._remember(user_id, user_message_id, row[0])
+        return row[0]
+
+    async def flush(self):
+        """Записывает новые связи одной транзакцией"""
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        try:
+            async with self.db.transaction() as db:
+                await db.executemany(
+                    '''INSERT OR REPLACE INTO message_links
+                    (user_id, user_message_id, forum_message_id, topic_id, created)
+                    VALUES (?, ?, ?, ?, ?)''',
+                    rows
+                )
+        except Exception as e:
+            self.pending = rows + self.pending
+            logger.error(f"Ошибка записи связей сообщений: {str(e)}")
+
+    async def prune(self):
+        """Удаляет связи старше LINK_TTL"""
+        async with self.db.transaction() as db:
+            cursor = await db.execute(
+                "DELETE FROM message_links WHERE created < ?",
+                (time.time() - LINK_TTL,)
+            )
+        if cursor.rowcount:
+            logger.info(f"Удалено старых связей сообщений: {cursor.rowcount}")
+
+    async def _prune(self):
+        try:
+            await self.prune()
+        except Exception as e:
+            logger.error(f"Ошибка очистки связей сообщений: {str(e)}")
+
+    async def _flush_loop(self):
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                await self._prune()
+
+    async def start(self):
+        """Чистит старые связи и запускает периодическую запись и очистку"""
+        await self._prune()
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Останавливает периодическую запись и сохраняет остаток"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
+
+message_map = MessageMap(chats_db)
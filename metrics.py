@@ -0,0 +1,238 @@
+import bisect
+import logging
+import time
+from typing import Any, Callable, Mapping
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    "enabled": False,
+    "host": "127.0.0.1",
+    "port": 9100,
+    "path": "/metrics",
+}
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def metrics_settings(config: Mapping[str, Any]) -> dict:
+    """Настройки эндпоинта метрик из конфигурации с значениями по умолчанию"""
+    return {**METRICS_DEFAULTS, **config.get("metrics", {})}
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    """Базовая метрика с набором значений по меткам"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self.values.items()
+        ]
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией в момент сбора"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[tuple, float] = {}
+        self.function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def samples(self) -> list[str]:
+        values = dict(self.values)
+        if self.function is not None:
+            try:
+                values[()] = self.function()
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {self.name}: {str(e)}")
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными границами корзин"""
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # По меткам: количества по корзинам (последняя — +Inf), сумма
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {total}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self.sums[key])}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    "ticketbot_handler_seconds", "Время выполнения обработчиков", ("event", "handler")
+))
+handler_errors = registry.register(Counter(
+    "ticketbot_handler_errors_total", "Исключения, вышедшие из обработчиков", ("event", "handler")
+))
+tickets_total = registry.register(Counter(
+    "ticketbot_tickets_total", "Начатые заявки по типам", ("type",)
+))
+ticket_messages_total = registry.register(Counter(
+    "ticketbot_ticket_messages_total", "Сообщения заявок, доставленные в форум", ("type",)
+))
+db_seconds = registry.register(Histogram(
+    "ticketbot_db_seconds", "Время запросов к SQLite", ("database", "operation")
+))
+api_requests_total = registry.register(Counter(
+    "ticketbot_api_requests_total", "Запросы к Telegram Bot API по результату", ("method", "result")
+))
+api_seconds = registry.register(Histogram(
+    "ticketbot_api_seconds", "Время запросов к Telegram Bot API", ("method",)
+))
+ban_cache_size = registry.register(Gauge(
+    "ticketbot_ban_cache_size", "Активные баны в кэше"
+))
+ban_refresh_seconds = registry.register(Histogram(
+    "ticketbot_ban_cache_refresh_seconds", "Время полной синхронизации кэша банов"
+))
+active_states = registry.register(Gauge(
+    "ticketbot_active_states", "Открытые заявки с отслеживаемым таймаутом"
+))
+topic_cache_hits = registry.register(Gauge(
+    "ticketbot_topic_cache_hits", "Попадания в кэш тем с запуска"
+))
+topic_cache_misses = registry.register(Gauge(
+    "ticketbot_topic_cache_misses", "Промахи кэша тем с запуска"
+))
+topic_cache_size = registry.register(Gauge(
+    "ticketbot_topic_cache_size", "Пользователи в кэше тем"
+))
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика (внутренний middleware роутера)"""
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(event=self.event, handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, event=self.event, handler=name)
+
+class APIMetricsMiddleware(BaseRequestMiddleware):
+    """Считает запросы к Bot API, их время и ошибки"""
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            api_requests_total.inc(method=api_method, result=type(e).__name__)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - started, method=api_method)
+        api_requests_total.inc(method=api_method, result="ok")
+        return response
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+async def start_metrics_server(settings: Mapping[str, Any], port_offset: int = 0) -> web.AppRunner:
+    """Запускает HTTP-сервер с эндпоинтом метрик"""
+    app = web.Application()
+    app.router.add_get(settings["path"], _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = int(settings["port"]) + port_offset
+    await web.TCPSite(runner, settings["host"], port).start()
+    logger.info(f"Метрики доступны на {settings['host']}:{port}{settings['path']}")
+    return runner
@@ -1,61 +1,82 @@
 import time
-import aiosqlite
 import asyncio
+import heapq
+import itertools
 import logging
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.middleware import StorageKey
-from handlers import parse_time,get_or_create_topic
-from load_config import load_config
+from handlers import get_or_create_topic
+from time_utils import parse_time
+from load_config import get_config, config_version
+from ban_cache import ban_cache
+from logging_setup import log_context
+from profiles import profiles
 
-# Настройка логгера
+# Логгер модуля; вывод настраивается в logging_setup
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(f"logs/{__name__}.log", mode='a',encoding='utf-8')
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-DATABASE = 'data/bans.db'
-CACHE_TTL = 30  # seconds
 
 class AsyncIgnoreMiddleware(BaseMiddleware):
     """Middleware для игнорирования забаненных пользователей и управления состояниями"""
     
     def __init__(self, storage: BaseStorage):
-        self.cache = {}
-        self.last_cache_update = 0
-        self.cache_ttl = CACHE_TTL
-        self.db_path = DATABASE
+        self.bans = ban_cache
         self.bot = None
         self.storage = storage
-        self.active_states = set()
+        # Время последней активности открытых состояний и куча их сроков истечения
+        self.active_states: dict[StorageKey, float] = {}
+        self.deadlines: list[tuple[float, int, StorageKey]] = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._timeout = None
+        self._timeout_version = None
         self.user = None
         self.timeout_task = asyncio.create_task(self.check_states_timeout())
         logger.info("Middleware инициализирован")
 
     @property
     def config(self):
-        return load_config()
+        return get_config()
+
+    @property
+    def state_timeout(self) -> int:
+        """Таймаут состояния; при смене конфигурации сроки пересчитываются"""
+        version = config_version()
+        if version != self._timeout_version:
+            self._timeout_version = version
+            timeout = parse_time(self.config.get("state_timeout", "30m"))
+            if timeout != self._timeout:
+                self._timeout = timeout
+                self._rebuild_deadlines()
+        return self._timeout
+
+    def _rebuild_deadlines(self):
+        """Строит кучу сроков заново (смена таймаута или много устаревших записей)"""
+        self.deadlines = [
+            (last_activity + self._timeout, next(self._sequence), key)
+            for key, last_activity in self.active_states.items()
+        ]
+        heapq.heapify(self.deadlines)
+        self._wakeup.set()
+
+    def touch_state(self, storage_key: StorageKey, current_time: float):
+        """Отмечает активность состояния и планирует его истечение"""
+        self.active_states[storage_key] = current_time
+        timeout = self.state_timeout
+        entry = (current_time + timeout, next(self._sequence), storage_key)
+        heapq.heappush(self.deadlines, entry)
+        if len(self.deadlines) > 4 * len(self.active_states) + 1024:
+            self._rebuild_deadlines()
+        elif self.deadlines[0] is entry:
+            self._wakeup.set()
     
-    async def update_cache(self):
-        """Обновляет кэш забаненных пользователей"""
-        try:
-            current_time = time.time()
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("PRAGMA journal_mode=WAL")
-                cursor = await db.execute(
-                    '''SELECT user_id, ban_end FROM ignored_users 
-                    WHERE ban_end > ?''',
-                    (current_time,)
-                )
-                self.cache = {row[0]: row[1] for row in await cursor.fetchall()}
-                self.last_cache_update = current_time
-                logger.info("Кэш банов обновлен")
-        except Exception as e:
-            logger.error(f"Ошибка обновления кэша: {str(e)}")
+    def restore_states(self, states: dict[StorageKey, float]):
+        """Планирует таймауты для состояний, восстановленных из хранилища"""
+        for storage_key, last_activity in states.items():
+            self.touch_state(storage_key, last_activity)
+        logger.info(f"Восстановлено таймаутов состояний: {len(states)}")
 
     async def __call__(self, handler, event: Message, data):
         """Обрабатывает входящие сообщения"""
@@ -70,12 +91,8 @@ class AsyncIgnoreMiddleware(BaseMiddleware):
             user_id = event.from_user.id
             current_time = time.time()
 
-            # Обновление кэша банов
-            if current_time - self.last_cache_update > self.cache_ttl:
-                await self.update_cache()
-
             # Проверка бана для текущего пользователя
-            if user_id in self.cache and current_time < self.cache[user_id]:
+            if self.bans.is_banned(user_id, current_time):
                 logger.info(f"Сообщение от забаненного пользователя {user_id} проигнорировано")
                 return
                 
@@ -86,10 +103,13 @@ class AsyncIgnoreMiddleware(BaseMiddleware):
             elif event.reply_to_message and event.reply_to_message.forward_from:
                 original_user = event.reply_to_message.forward_from.id
             
-            if original_user and original_user in self.cache and current_time < self.cache[original_user]:
+            if original_user and self.bans.is_banned(original_user, current_time):
                 logger.info(f"Пересланное сообщение от забаненного пользователя {original_user} проигнорировано")
                 return
                 
+            if event.chat.type == "private":
+                profiles.remember(event.from_user)
+
             # Обновление времени активности состояния только для приватных чатов
             state: FSMContext = data.get('state')
             if state and await state.get_state() is not None and event.chat.type == "private":
@@ -99,56 +119,74 @@ class AsyncIgnoreMiddleware(BaseMiddleware):
                     user_id=user_id
                 )
                 await state.update_data(last_activity=current_time)
-                self.active_states.add(storage_key)
+                self.touch_state(storage_key, current_time)
                 logger.debug(f"Активность состояния обновлена для {user_id}")
 
-            return await handler(event, data)
+            # Все записи лога при обработке сообщения получают user_id и topic_id
+            with log_context(user_id=user_id, topic_id=event.message_thread_id):
+                return await handler(event, data)
         except Exception as e:
             logger.error(f"Ошибка в middleware: {str(e)}")
             return await handler(event, data)
     
     async def check_states_timeout(self):
-        """Проверяет и сбрасывает состояния по таймауту"""
+        """Спит до ближайшего срока и сбрасывает только истекшие состояния"""
         while True:
-            await asyncio.sleep(10)
-            current_time = time.time()
-            timeout = parse_time(self.config.get("state_timeout", "30m"))
+            timeout = self.state_timeout
+            delay = self.deadlines[0][0] - time.time() if self.deadlines else None
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, storage_key = heapq.heappop(self.deadlines)
+            last_activity = self.active_states.get(storage_key)
+            # Устаревшая запись: состояние уже сброшено или было активно позже
+            if last_activity is None or last_activity + timeout > time.time():
+                continue
+            await self.expire_state(storage_key)
+
+    async def expire_state(self, storage_key: StorageKey):
+        """Сбрасывает состояние по таймауту"""
+        last_activity = self.active_states.get(storage_key)
+        try:
+            state = FSMContext(storage=self.storage, key=storage_key)
+            if not await state.get_state():
+                self.active_states.pop(storage_key, None)
+                return
+
+            # Получаем пользователя из данных состояния
+            user_data = await state.get_data()
+            user = user_data.get('user')
+            if user:
+                # Актуальное имя из последних сообщений вместо сохраненного в начале заявки
+                user = profiles.peek(user.id) or user
             
-            for storage_key in list(self.active_states):
+            if user and self.bot:
+                # Обновляем тему с emoji для unbanned
                 try:
-                    state = FSMContext(storage=self.storage, key=storage_key)
-                    if not await state.get_state():
-                        self.active_states.discard(storage_key)
-                        continue
-                        
-                    data = await state.get_data()
-                    last_activity = data.get("last_activity", 0)
-                    
-                    if current_time - last_activity > timeout:
-                        # Получаем пользователя из данных состояния
-                        user_data = await state.get_data()
-                        user = user_data.get('user')  # Предполагаем, что пользователь сохранен в данных состояния
-                        
-                        if user and self.bot:
-                            # Обновляем тему с emoji для unbanned
-                            try:
-                                topic_id = await get_or_create_topic(
-                                    user=user,
-                                    request_type="unbanned",  # Тип для unbanned
-                                    bot=self.bot
-                                )
-                                logger.info(f"Тема обновлена с emoji unbanned для пользователя {user.id}")
-                            except Exception as e:
-                                logger.error(f"Ошибка при обновлении темы: {e}")
-                        
-                        await state.clear()
-                        self.active_states.discard(storage_key)
-                        logger.info(f"Состояние сброшено по таймауту для {storage_key.user_id}")
-                        
+                    topic_id = await get_or_create_topic(
+                        user=user,
+                        request_type="unbanned",  # Тип для unbanned
+                        bot=self.bot
+                    )
+                    logger.info(f"Тема обновлена с emoji unbanned для пользователя {user.id}")
                 except Exception as e:
-                    logger.error(f"Ошибка обработки состояния: {e}")
-                    self.active_states.discard(storage_key)
-
+                    logger.error(f"Ошибка при обновлении темы: {e}")
+            
+            # Пока переименовывалась тема, пользователь мог начать новую заявку
+            current_data = await state.get_data()
+            if current_data.get("last_activity") == user_data.get("last_activity"):
+                await state.clear()
+                logger.info(f"Состояние сброшено по таймауту для {storage_key.user_id}")
+        except Exception as e:
+            logger.error(f"Ошибка обработки состояния: {e}")
+        # Новая активность за время сброса уже запланировала свой срок
+        if self.active_states.get(storage_key) == last_activity:
+            self.active_states.pop(storage_key, None)
 
     async def close(self):
         """Остановка фоновых задач"""
@@ -0,0 +1,188 @@
+import logging
+from database import Database, chats_db, bans_db, fsm_db, history_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+# Миграции: (версия, список SQL-выражений). Версия хранится в PRAGMA user_version.
+CHATS_MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS chats
+            (user_id INTEGER,
+             topic_id INTEGER,
+             type TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS confirmations
+            (user_id INTEGER PRIMARY KEY,
+             last_sent REAL)''',
+    ]),
+    # Уникальный ключ по user_id (с удалением дублей от гонок) и индекс по topic_id
+    (2, [
+        '''CREATE TABLE chats_new
+            (user_id INTEGER PRIMARY KEY,
+             topic_id INTEGER NOT NULL,
+             type TEXT)''',
+        '''INSERT INTO chats_new (user_id, topic_id, type)
+            SELECT user_id, topic_id, type FROM chats
+            WHERE rowid IN (
+                SELECT MIN(rowid) FROM chats
+                WHERE user_id IS NOT NULL AND topic_id IS NOT NULL
+                GROUP BY user_id
+            )''',
+        'DROP TABLE chats',
+        'ALTER TABLE chats_new RENAME TO chats',
+        'CREATE INDEX IF NOT EXISTS idx_chats_topic_id ON chats(topic_id)',
+    ]),
+    # Номер изменения строки, по которому другие процессы подтягивают обновления
+    (3, [
+        'ALTER TABLE chats ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        'CREATE INDEX IF NOT EXISTS idx_chats_version ON chats(version)',
+    ]),
+    # Последнее примененное название темы, чтобы не переименовывать ее без изменений
+    (4, [
+        'ALTER TABLE chats ADD COLUMN name TEXT',
+    ]),
+    # Связи сообщений пользователя (user_id, id в ЛС) и их копий в форуме
+    (5, [
+        '''CREATE TABLE IF NOT EXISTS message_links (
+            user_id INTEGER NOT NULL,
+            user_message_id INTEGER NOT NULL,
+            forum_message_id INTEGER NOT NULL,
+            topic_id INTEGER,
+            created REAL NOT NULL,
+            PRIMARY KEY (user_id, user_message_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_message_links_forum ON message_links(forum_message_id)',
+        'CREATE INDEX IF NOT EXISTS idx_message_links_created ON message_links(created)',
+    ]),
+    # Очередь пересылок: задания хранятся до успешной отправки и переживают перезапуск
+    # (owner — id чата исходного обновления, по нему задания распределяются между воркерами)
+    (6, [
+        '''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            queue TEXT NOT NULL,
+            owner INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL,
+            created REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_owner ON outbox(owner, id)',
+    ]),
+]
+
+BANS_MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS ignored_users (
+            user_id INTEGER PRIMARY KEY,
+            ban_end REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_ban_end ON ignored_users(ban_end)',
+    ]),
+]
+
+FSM_MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            bot_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            thread_id INTEGER,
+            business_connection_id TEXT,
+            destiny TEXT NOT NULL,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}'
+        )''',
+    ]),
+]
+
+# Текст пересланных сообщений; history_fts — внешний индекс FTS5 над history.text
+HISTORY_MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            created REAL NOT NULL,
+            direction TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            topic_id INTEGER,
+            forum_message_id INTEGER NOT NULL,
+            request_type TEXT,
+            text TEXT NOT NULL
+        )''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            text,
+            content='history',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts(rowid, text) VALUES (new.id, new.text);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts(history_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END''',
+        'CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id)',
+    ]),
+]
+
+# Индексы, наличие которых проверяется при запуске
+REQUIRED_INDEXES = {
+    chats_db: ["idx_chats_topic_id", "idx_chats_version", "idx_message_links_forum", "idx_outbox_owner"],
+    bans_db: ["idx_ban_end"],
+    history_db: ["idx_history_user"],
+}
+
+SCHEMAS = {
+    chats_db: CHATS_MIGRATIONS,
+    bans_db: BANS_MIGRATIONS,
+    fsm_db: FSM_MIGRATIONS,
+    history_db: HISTORY_MIGRATIONS,
+}
+
+async def get_version(db: Database) -> int:
+    """Возвращает текущую версию схемы базы"""
+    row = await db.fetchone("PRAGMA user_version")
+    return row[0]
+
+async def migrate(db: Database, migrations):
+    """Применяет недостающие миграции, каждую в отдельной транзакции"""
+    current = await get_version(db)
+    for version, statements in migrations:
+        if version <= current:
+            continue
+        async with db.transaction() as connection:
+            await connection.execute("BEGIN IMMEDIATE")
+            for statement in statements:
+                await connection.execute(statement)
+            await connection.execute(f"PRAGMA user_version = {int(version)}")
+        logger.info(f"{db.path}: схема обновлена до версии {version}")
+        current = version
+
+async def verify(db: Database, migrations, indexes):
+    """Проверяет версию схемы, наличие индексов и целостность базы"""
+    expected = migrations[-1][0]
+    current = await get_version(db)
+    if current != expected:
+        raise RuntimeError(f"{db.path}: версия схемы {current}, ожидалась {expected}")
+
+    rows = await db.fetchall("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in rows}
+    missing = [name for name in indexes if name not in existing]
+    if missing:
+        raise RuntimeError(f"{db.path}: отсутствуют индексы {', '.join(missing)}")
+
+    check = await db.fetchone("PRAGMA quick_check")
+    if check[0] != "ok":
+        raise RuntimeError(f"{db.path}: проверка целостности не пройдена: {check[0]}")
+    logger.info(f"{db.path}: схема версии {current} проверена")
+
+async def migrate_databases():
+    """Обновляет схемы всех баз данных"""
+    for db, migrations in SCHEMAS.items():
+        await migrate(db, migrations)
+
+async def verify_databases():
+    """Проверяет схемы всех баз данных"""
+    for db, migrations in SCHEMAS.items():
+        await verify(db, migrations, REQUIRED_INDEXES.get(db, []))
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import deque
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from database import Database, chats_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = 8
+PRIORITY_WORKERS = 2
+MAX_ATTEMPTS = 10
+BASE_DELAY = 1  # seconds
+MAX_DELAY = 300  # seconds
+
+class Job:
+    """Задание очереди пересылок"""
+    __slots__ = ("id", "kind", "queue", "payload", "attempts", "next_attempt")
+
+    def __init__(self, job_id: int, kind: str, queue: str, payload: dict,
+                 attempts: int = 0, next_attempt: float = 0.0):
+        self.id = job_id
+        self.kind = kind
+        self.queue = queue
+        self.payload = payload
+        self.attempts = attempts
+        self.next_attempt = next_attempt
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная пауза перед повтором: 1, 2, 4, ... секунд, не больше MAX_DELAY"""
+    return min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1))
+
+# Ошибки, после которых отправку стоит повторить: сеть, сервер Telegram, flood control,
+# таймаут и занятая другим процессом база
+TRANSIENT_ERRORS = (
+    TelegramRetryAfter,
+    TelegramNetworkError,
+    TelegramServerError,
+    asyncio.TimeoutError,
+    sqlite3.OperationalError,
+)
+
+class DeliveryError(Exception):
+    """Отправка невозможна, и повтор этого не исправит (например, не настроен чат)"""
+
+def is_transient(error: Exception) -> bool:
+    """Повторять ли отправку; остальные ошибки (нет сообщения, бот заблокирован,
+    нет прав на темы, ошибки кода) сразу отменяют задание"""
+    return isinstance(error, TRANSIENT_ERRORS)
+
+class Outbox:
+    """Очередь пересылок в SQLite. Запись в базу идет групповыми транзакциями,
+    отправка — в фоне по порядку внутри каждой очереди с повторами при сбоях."""
+
+    def __init__(self, db: Database, workers: int = OUTBOX_WORKERS,
+                 priority_workers: int = PRIORITY_WORKERS):
+        self.db = db
+        self.workers = workers
+        self.priority_workers = priority_workers
+        self.bot: Bot | None = None
+        self.senders: dict = {}
+        self.on_drop = None
+        self.priority_kinds: frozenset = frozenset()
+        # Задания по очередям; очередь активна, пока в ней есть задания
+        self.queues: dict[str, deque[Job]] = {}
+        # Готовые к отправке очереди; у приоритетных видов свои воркеры,
+        # чтобы они не ждали за заданиями, упершимися в лимиты
+        self.ready: asyncio.Queue[str] = asyncio.Queue()
+        self.priority_ready: asyncio.Queue[str] = asyncio.Queue()
+        # Ожидающие записи: новые задания, выполненные и перенесенные
+        self.new: list[tuple[str, str, int, str, asyncio.Future]] = []
+        self.done: list[int] = []
+        self.retries: list[tuple[int, float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closing = False
+        self.tasks: list[asyncio.Task] = []
+        self.commit_task = None
+
+    async def start(self, bot: Bot, senders: dict, on_drop=None, owns=None, priority_kinds=()):
+        """Загружает незавершенные задания и запускает отправку.
+        senders: вид задания → send(bot, payload); on_drop(bot, kind, payload, error) — при отказе.
+        owns(owner) отбирает задания своей доли (в режиме нескольких воркеров).
+        Очереди видов из priority_kinds обслуживают отдельные воркеры."""
+        self.bot = bot
+        self.senders = senders
+        self.on_drop = on_drop
+        self.priority_kinds = frozenset(priority_kinds)
+        rows = await self.db.fetchall(
+            "SELECT id, kind, queue, owner, payload, attempts, next_attempt FROM outbox ORDER BY id"
+        )
+        resumed = 0
+        for job_id, kind, queue, owner, payload, attempts, next_attempt in rows:
+            # Доля определяется по текущему числу воркеров, как для новых обновлений
+            if owns is not None and not owns(owner):
+                continue
+            self._append(Job(job_id, kind, queue, json.loads(payload), attempts, next_attempt))
+            resumed += 1
+        if resumed:
+            logger.info(f"Возобновлено отложенных пересылок: {resumed}")
+        self._update_idle()
+        if not self.tasks:
+            self._closing = False
+            self.commit_task = asyncio.create_task(self._commit_loop())
+            self.tasks = [asyncio.create_task(self._worker(self.ready)) for _ in range(self.workers)]
+            self.tasks += [
+                asyncio.create_task(self._worker(self.priority_ready))
+                for _ in range(self.priority_workers)
+            ]
+
+    def _append(self, job: Job):
+        queue = self.queues.setdefault(job.queue, deque())
+        queue.append(job)
+        if len(queue) == 1:
+            self._schedule(job.queue, job.next_attempt - time.time())
+
+    def _schedule(self, queue: str, delay: float):
+        # Вид заданий одной очереди не меняется, поэтому достаточно первого
+        ready = self.priority_ready if self.queues[queue][0].kind in self.priority_kinds else self.ready
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, ready.put_nowait, queue)
+        else:
+            ready.put_nowait(queue)
+
+    def _update_idle(self):
+        if self.new or self.queues:
+            self._idle.clear()
+        else:
+            self._idle.set()
+
+    async def put(self, kind: str, queue: str, payload: dict, owner: int) -> int:
+        """Записывает задание в базу и возвращает его id; отправка идет в фоне.
+        Задания одной очереди (queue) отправляются строго по порядку.
+        owner — id чата, из которого пришло обновление: по нему задание после перезапуска
+        достается тому же воркеру, что и новые задания этой очереди."""
+        future = asyncio.get_running_loop().create_future()
+        self.new.append((kind, queue, owner, json.dumps(payload, ensure_ascii=False), future))
+        self._idle.clear()
+        self._wakeup.set()
+        return await future
+
+    async def _commit(self):
+        """Одна транзакция на все накопившиеся изменения"""
+        new, self.new = self.new, []
+        done, self.done = self.done, []
+        retries, self.retries = self.retries, []
+        if not (new or done or retries):
+            return
+        now = time.time()
+        ids = []
+        try:
+            async with self.db.transaction() as db:
+                for kind, queue, owner, payload, _ in new:
+                    cursor = await db.execute(
+                        '''INSERT INTO outbox (kind, queue, owner, payload, next_attempt, created)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                        (kind, queue, owner, payload, now, now)
+                    )
+                    ids.append(cursor.lastrowid)
+                await db.executemany("DELETE FROM outbox WHERE id = ?", [(job_id,) for job_id in done])
+                await db.executemany(
+                    "UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                    retries
+                )
+        except Exception as e:
+            logger.error(f"Ошибка записи очереди пересылок: {str(e)}")
+            for *_, future in new:
+                if not future.done():
+                    future.set_exception(e)
+            self.done = done + self.done
+            self.retries = retries + self.retries
+            self._update_idle()
+            return
+        for job_id, (kind, queue, _, payload, future) in zip(ids, new):
+            self._append(Job(job_id, kind, queue, json.loads(payload), next_attempt=now))
+            if not future.done():
+                future.set_result(job_id)
+        self._update_idle()
+
+    async def _commit_loop(self):
+        # Пока идет одна транзакция, следующие изменения копятся для следующей
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._commit()
+
+    async def _worker(self, ready: asyncio.Queue):
+        while True:
+            name = await ready.get()
+            queue = self.queues.get(name)
+            if not queue:
+                continue
+            job = queue[0]
+            delay = await self._deliver(job)
+            if delay is not None:
+                self._schedule(name, delay)
+                continue
+            queue.popleft()
+            if queue:
+                self._schedule(name, 0)
+            else:
+                del self.queues[name]
+                self._update_idle()
+
+    async def _deliver(self, job: Job) -> float | None:
+        """Отправляет задание; возвращает паузу до повтора или None, если задание завершено"""
+        try:
+            await self.senders[job.kind](self.bot, job.payload)
+            self._finish(job)
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.attempts += 1
+            if is_transient(e) and job.attempts < MAX_ATTEMPTS:
+                delay = retry_delay(job.attempts)
+                if isinstance(e, TelegramRetryAfter):
+                    delay = max(delay, e.retry_after)
+                job.next_attempt = time.time() + delay
+                self.retries.append((job.attempts, job.next_attempt, job.id))
+                self._wakeup.set()
+                logger.warning(f"Пересылка {job.id} ({job.queue}) не удалась, повтор через {delay:.0f} с: {str(e)}")
+                return delay
+            logger.error(f"Пересылка {job.id} ({job.queue}) отменена после {job.attempts} попыток: {str(e)}")
+            self._finish(job)
+            if self.on_drop is not None:
+                try:
+                    await self.on_drop(self.bot, job.kind, job.payload, e)
+                except Exception as drop_error:
+                    logger.error(f"Ошибка обработки отмененной пересылки: {str(drop_error)}")
+            return None
+
+    def _finish(self, job: Job):
+        self.done.append(job.id)
+        self._wakeup.set()
+
+    async def join(self):
+        """Дожидается отправки или отмены всех заданий, включая отложенные на повтор"""
+        await self._idle.wait()
+
+    def pending(self) -> int:
+        """Число неотправленных заданий"""
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def close(self):
+        """Останавливает отправку; незавершенные задания остаются в базе до следующего запуска"""
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        # Транзакцию не прерываем: цикл записи завершается после текущей
+        if self.commit_task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self.commit_task
+            self.commit_task = None
+        await self._commit()
+        if self.queues:
+            logger.info(f"Отложено до следующего запуска: {self.pending()}")
+
+outbox = Outbox(chats_db)
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.types import User
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+PROFILE_TTL = 3600  # seconds
+PROFILE_CACHE_SIZE = 100_000
+
+class ProfileCache:
+    """Кэш имен и юзернеймов пользователей из входящих сообщений и get_chat"""
+
+    def __init__(self, ttl: float = PROFILE_TTL, capacity: int = PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.profiles: OrderedDict[int, tuple[float, User]] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = {}
+
+    def remember(self, user: User):
+        """Запоминает актуальный профиль пользователя"""
+        self.profiles[user.id] = (time.monotonic(), user)
+        self.profiles.move_to_end(user.id)
+        while len(self.profiles) > self.capacity:
+            self.profiles.popitem(last=False)
+
+    def peek(self, user_id: int) -> User | None:
+        """Профиль из кэша, если он еще не устарел"""
+        cached = self.profiles.get(user_id)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            return None
+        return cached[1]
+
+    async def get(self, bot: Bot, user_id: int) -> User:
+        """Профиль из кэша или через get_chat (один запрос на всех ожидающих)"""
+        user = self.peek(user_id)
+        if user is not None:
+            return user
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(bot, user_id))
+            self._loading[user_id] = future
+            future.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, bot: Bot, user_id: int) -> User:
+        user_info = await bot.get_chat(user_id)
+        user = User(
+            id=user_id,
+            is_bot=False,
+            first_name=user_info.first_name,
+            last_name=user_info.last_name,
+            username=user_info.username
+        )
+        self.remember(user)
+        logger.debug(f"Профиль пользователя {user_id} загружен")
+        return user
+
+    def snapshot(self) -> list:
+        """Профили в порядке LRU: [user_id, возраст, имя, фамилия, юзернейм]"""
+        now = time.monotonic()
+        return [
+            [user.id, now - loaded, user.first_name, user.last_name, user.username]
+            for loaded, user in self.profiles.values()
+        ]
+
+    def restore(self, data: list, elapsed: float):
+        """Загружает профили из снимка, пропуская устаревшие"""
+        now = time.monotonic()
+        for user_id, age, first_name, last_name, username in data:
+            age += elapsed
+            if age > self.ttl or user_id in self.profiles:
+                continue
+            user = User(id=user_id, is_bot=False, first_name=first_name, last_name=last_name, username=username)
+            self.profiles[user_id] = (now - age, user)
+        while len(self.profiles) > self.capacity:
+            self.profiles.popitem(last=False)
+
+profiles = ProfileCache()
@@ -0,0 +1,17 @@
+from aiogram.types import Update
+
+def shard_key(update: Update) -> int:
+    """Ключ распределения обновления: id чата, в котором оно произошло.
+    Для личных чатов он совпадает с user_id, поэтому все обновления пользователя
+    попадают в один воркер, а весь форумный чат обрабатывается одним воркером."""
+    if update.callback_query:
+        callback = update.callback_query
+        return callback.message.chat.id if callback.message else callback.from_user.id
+    for event in (update.message, update.edited_message, update.chat_member, update.my_chat_member):
+        if event is not None:
+            return event.chat.id
+    return update.update_id
+
+def shard_of(key: int, workers: int) -> int:
+    """Номер воркера для ключа распределения"""
+    return abs(key) % workers
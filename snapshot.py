@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from admin_cache import admin_cache
+from cooldowns import cooldowns
+from profiles import profiles
+from topic_cache import topic_map
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = 'data/cache_snapshot-{}.json.gz'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_MAX_AGE = 24 * 3600  # seconds
+
+def snapshot_path(worker: int = 0) -> str:
+    """Файл снимка процесса (у каждого воркера свой)"""
+    return SNAPSHOT_PATH.format(worker)
+
+def _write(path: str, data: dict):
+    # Запись во временный файл и замена, чтобы не оставить половину снимка
+    temp_path = f"{path}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+def _read(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+async def save_snapshot(path: str, bot_id: int):
+    """Сохраняет кэши процесса при штатной остановке (до закрытия баз)"""
+    try:
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "bot_id": bot_id,
+            "created": time.time(),
+            "topics": await topic_map.snapshot(),
+            "admins": admin_cache.snapshot(),
+            "profiles": profiles.snapshot(),
+            "cooldowns": cooldowns.snapshot(),
+        }
+        await asyncio.to_thread(_write, path, data)
+        logger.info(
+            f"Снимок кэшей сохранен: тем {len(data['topics']['entries'])}, "
+            f"профилей {len(data['profiles'])}, подтверждений {len(data['cooldowns'])}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка сохранения снимка кэшей: {str(e)}")
+
+async def restore_snapshot(path: str, bot_id: int) -> bool:
+    """Загружает кэши из снимка, если он подходит этому боту и не устарел.
+    Файл удаляется: после аварийной остановки старый снимок не применяется.
+    Возвращает True, если кэш тем восстановлен и прогревать его из базы не нужно."""
+    if not os.path.exists(path):
+        return False
+    try:
+        data = await asyncio.to_thread(_read, path)
+    except Exception as e:
+        logger.error(f"Ошибка чтения снимка кэшей: {str(e)}")
+        return False
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    elapsed = time.time() - data.get("created", 0)
+    if data.get("format") != SNAPSHOT_FORMAT or data.get("bot_id") != bot_id:
+        logger.warning("Снимок кэшей от другой версии или другого бота пропущен")
+        return False
+    if not 0 <= elapsed <= SNAPSHOT_MAX_AGE:
+        logger.warning(f"Снимок кэшей устарел ({elapsed:.0f} с) и пропущен")
+        return False
+
+    try:
+        admin_cache.restore(data["admins"], elapsed)
+        profiles.restore(data["profiles"], elapsed)
+        cooldowns.restore(data["cooldowns"])
+        restored = await topic_map.restore(data["topics"])
+        logger.info(f"Кэши восстановлены из снимка {elapsed:.0f} с давности")
+        return restored
+    except Exception as e:
+        logger.error(f"Ошибка восстановления снимка кэшей: {str(e)}")
+        return False
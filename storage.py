@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+from typing import Any, Mapping
+from aiogram import types
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+from database import Database, fsm_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1  # seconds
+
+def _encode(value):
+    """Сериализует объекты Telegram (например, User в данных заявки)"""
+    if isinstance(value, TelegramObject):
+        return {
+            "__telegram__": type(value).__name__,
+            "value": value.model_dump(mode="json", exclude_none=True),
+        }
+    raise TypeError(f"Объект типа {type(value).__name__} не сериализуется")
+
+def _decode(value: dict):
+    cls = getattr(types, value["__telegram__"], None) if "__telegram__" in value else None
+    if cls is None:
+        return value
+    return cls.model_validate(value["value"])
+
+def _key_id(key: StorageKey) -> str:
+    return ":".join(
+        "" if part is None else str(part)
+        for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                     key.business_connection_id, key.destiny)
+    )
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в памяти с пакетной записью изменений в SQLite"""
+
+    def __init__(self, db: Database = fsm_db, flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.states: dict[StorageKey, str | None] = {}
+        self.data: dict[StorageKey, dict[str, Any]] = {}
+        self.dirty: set[StorageKey] = set()
+        self.flush_task = None
+
+    async def load(self, owns=None):
+        """Загружает сохраненные состояния в память.
+        owns(key) отбирает ключи этого процесса в режиме нескольких воркеров."""
+        rows = await self.db.fetchall(
+            '''SELECT bot_id, chat_id, user_id, thread_id, business_connection_id,
+            destiny, state, data FROM fsm_states'''
+        )
+        for bot_id, chat_id, user_id, thread_id, business_id, destiny, state, data in rows:
+            key = StorageKey(
+                bot_id=bot_id,
+                chat_id=chat_id,
+                user_id=user_id,
+                thread_id=thread_id,
+                business_connection_id=business_id,
+                destiny=destiny
+            )
+            if owns is not None and not owns(key):
+                continue
+            try:
+                self.data[key] = json.loads(data, object_hook=_decode)
+            except Exception as e:
+                logger.error(f"Ошибка чтения данных состояния {_key_id(key)}: {str(e)}")
+                self.data[key] = {}
+            self.states[key] = state
+        logger.info(f"Загружено состояний: {len(self.states)}")
+
+    def start(self):
+        """Запускает периодическую запись"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка периодической записи состояний: {str(e)}")
+
+    async def flush(self):
+        """Записывает измененные состояния одной транзакцией"""
+        if not self.dirty:
+            return
+        keys, self.dirty = self.dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            state = self.states.get(key)
+            data = self.data.get(key)
+            if state is None and not data:
+                deletes.append((_key_id(key),))
+                continue
+            try:
+                encoded = json.dumps(data or {}, ensure_ascii=False, default=_encode)
+            except Exception as e:
+                # Такие данные не записать и повтором; остальные ключи пишутся как обычно
+                logger.error(f"Ошибка сериализации данных состояния {_key_id(key)}: {str(e)}")
+                continue
+            upserts.append((
+                _key_id(key), key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                key.business_connection_id, key.destiny, state, encoded
+            ))
+        try:
+            async with self.db.transaction() as db:
+                await db.executemany(
+                    '''INSERT OR REPLACE INTO fsm_states (key, bot_id, chat_id, user_id,
+                    thread_id, business_connection_id, destiny, state, data)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    upserts
+                )
+                await db.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+        except Exception as e:
+            self.dirty |= keys
+            logger.error(f"Ошибка записи состояний: {str(e)}")
+
+    def last_activity(self) -> dict[StorageKey, float]:
+        """Время последней активности для всех открытых состояний"""
+        return {
+            key: self.data.get(key, {}).get("last_activity", 0)
+            for key, state in self.states.items() if state is not None
+        }
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self.states[key] = state.state if isinstance(state, State) else state
+        if self.states[key] is None and not self.data.get(key):
+            self.states.pop(key, None)
+            self.data.pop(key, None)
+        self.dirty.add(key)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return self.states.get(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self.data[key] = dict(data)
+        if not data and self.states.get(key) is None:
+            self.states.pop(key, None)
+            self.data.pop(key, None)
+        self.dirty.add(key)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return self.data.get(key, {}).copy()
+
+    async def close(self) -> None:
+        """Останавливает периодическую запись и сохраняет остаток"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
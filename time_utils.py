@@ -0,0 +1,14 @@
+def parse_time(time_str: str) -> int:
+    """Преобразует строку времени в секунды: "30", "30m", "2h", "7d"; 0 при ошибке"""
+    if not isinstance(time_str, str):
+        return 0
+
+    if time_str.isdigit():
+        return int(time_str)
+
+    suffixes = {'m': 60, 'h': 3600, 'd': 86400}
+    if time_str[:-1].isdigit() and time_str[-1].isalpha():
+        suffix = time_str[-1].lower()
+        if suffix in suffixes:
+            return int(time_str[:-1]) * suffixes[suffix]
+    return 0
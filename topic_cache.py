@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from database import Database, chats_db
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+TOPIC_CACHE_SIZE = 100_000
+WATCH_INTERVAL = 1  # seconds
+
+# Отметка "темы нет в базе" для кэширования промахов по topic_id
+_MISSING = object()
+
+class TopicMap:
+    """Двусторонний LRU-кэш пользователь ↔ тема с записью в SQLite"""
+
+    def __init__(self, db: Database, capacity: int = TOPIC_CACHE_SIZE):
+        self.db = db
+        self.capacity = capacity
+        self.by_user: OrderedDict[int, tuple[int, str]] = OrderedDict()
+        self.by_topic: OrderedDict[int, object] = OrderedDict()
+        # Последнее примененное название темы (для тем из by_user)
+        self.names: dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+        # Последний виденный номер изменения в таблице chats
+        self.version = 0
+        self.data_version = None
+        self.watch_task = None
+
+    def _remember(self, user_id: int, topic_id: int, request_type: str, name: str | None = None):
+        """Кладет связь в оба направления кэша, вытесняя самые старые записи"""
+        previous = self.by_user.get(user_id)
+        if previous and previous[0] != topic_id:
+            self.by_topic.pop(previous[0], None)
+            self.names.pop(previous[0], None)
+        self.by_user[user_id] = (topic_id, request_type)
+        self.by_user.move_to_end(user_id)
+        self.by_topic[topic_id] = user_id
+        self.by_topic.move_to_end(topic_id)
+        if name is not None:
+            self.names[topic_id] = name
+        while len(self.by_user) > self.capacity:
+            _, (evicted_topic, _) = self.by_user.popitem(last=False)
+            self.names.pop(evicted_topic, None)
+        while len(self.by_topic) > self.capacity:
+            self.by_topic.popitem(last=False)
+
+    async def warm(self):
+        """Загружает последние связи из базы при запуске"""
+        row = await self.db.fetchone("SELECT COALESCE(MAX(version), 0) FROM chats")
+        self.version = row[0]
+        rows = await self.db.fetchall(
+            "SELECT user_id, topic_id, type, name FROM chats ORDER BY rowid DESC LIMIT ?",
+            (self.capacity,)
+        )
+        for user_id, topic_id, request_type, name in reversed(rows):
+            self._remember(user_id, topic_id, request_type, name)
+        logger.info(f"Кэш тем прогрет: {len(rows)} записей")
+
+    async def sync(self):
+        """Применяет изменения, записанные другими процессами"""
+        rows = await self.db.fetchall(
+            "SELECT user_id, topic_id, type, version, name FROM chats WHERE version > ? ORDER BY version",
+            (self.version,)
+        )
+        for user_id, topic_id, request_type, version, name in rows:
+            self._remember(user_id, topic_id, request_type, name)
+            self.version = max(self.version, version)
+        if rows:
+            logger.info(f"Кэш тем синхронизирован: {len(rows)} изменений")
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                data_version = await self.db.data_version()
+                if self.data_version is not None and data_version != self.data_version:
+                    await self.sync()
+                self.data_version = data_version
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации кэша тем: {str(e)}")
+
+    def start(self):
+        """Запускает отслеживание изменений от других процессов"""
+        if self.watch_task is None:
+            self.watch_task = asyncio.create_task(self._watch_loop())
+
+    async def close(self):
+        """Останавливает отслеживание изменений"""
+        if self.watch_task:
+            self.watch_task.cancel()
+            try:
+                await self.watch_task
+            except asyncio.CancelledError:
+                pass
+            self.watch_task = None
+
+    def peek(self, user_id: int) -> tuple[int, str] | None:
+        """Возвращает (topic_id, type) из кэша без обращения к базе"""
+        cached = self.by_user.get(user_id)
+        if cached is not None:
+            self.hits += 1
+            self.by_user.move_to_end(user_id)
+        return cached
+
+    async def get_by_user(self, user_id: int) -> tuple[int, str] | None:
+        """Возвращает (topic_id, type) для пользователя"""
+        cached = self.by_user.get(user_id)
+        if cached is not None:
+            self.hits += 1
+            self.by_user.move_to_end(user_id)
+            return cached
+        self.misses += 1
+        row = await self.db.fetchone(
+            "SELECT topic_id, type, name FROM chats WHERE user_id = ?",
+            (user_id,)
+        )
+        if row is None:
+            return None
+        self._remember(user_id, row[0], row[1], row[2])
+        return row[0], row[1]
+
+    async def get_user(self, topic_id: int) -> int | None:
+        """Возвращает user_id владельца темы"""
+        cached = self.by_topic.get(topic_id)
+        if cached is not None:
+            self.hits += 1
+            self.by_topic.move_to_end(topic_id)
+            return None if cached is _MISSING else cached
+        self.misses += 1
+        row = await self.db.fetchone(
+            "SELECT user_id, type, name FROM chats WHERE topic_id = ?",
+            (topic_id,)
+        )
+        if row is None:
+            self.by_topic[topic_id] = _MISSING
+            self.by_topic.move_to_end(topic_id)
+            while len(self.by_topic) > self.capacity:
+                self.by_topic.popitem(last=False)
+            return None
+        self._remember(row[0], topic_id, row[1], row[2])
+        return row[0]
+
+    async def store(self, user_id: int, topic_id: int, request_type: str, name: str | None = None):
+        """Сохраняет связь в базу и обновляет кэш; name — название новой темы"""
+        async with self.db.transaction() as db:
+            await db.execute(
+                '''INSERT INTO chats (user_id, topic_id, type, version, name)
+                VALUES (?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM chats), ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    topic_id = excluded.topic_id,
+                    type = excluded.type,
+                    version = excluded.version,
+                    name = COALESCE(excluded.name, name)''',
+                (user_id, topic_id, request_type, name)
+            )
+        self._remember(user_id, topic_id, request_type, name)
+
+    def name_of(self, topic_id: int) -> str | None:
+        """Последнее примененное название темы (если тема в кэше)"""
+        return self.names.get(topic_id)
+
+    async def snapshot(self) -> dict:
+        """Содержимое кэша в порядке LRU и номер изменения, которому оно соответствует"""
+        await self.sync()
+        entries = [
+            [user_id, topic_id, request_type, self.names.get(topic_id)]
+            for user_id, (topic_id, request_type) in self.by_user.items()
+        ]
+        return {"version": self.version, "entries": entries}
+
+    async def restore(self, data: dict) -> bool:
+        """Загружает кэш из снимка, если с тех пор таблица chats не менялась"""
+        row = await self.db.fetchone("SELECT COALESCE(MAX(version), 0) FROM chats")
+        if row[0] != data["version"]:
+            logger.info(f"Снимок кэша тем устарел: версия {data['version']}, в базе {row[0]}")
+            return False
+        for user_id, topic_id, request_type, name in data["entries"]:
+            self._remember(user_id, topic_id, request_type, name)
+        self.version = data["version"]
+        logger.info(f"Кэш тем восстановлен из снимка: {len(data['entries'])} записей")
+        return True
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "users": len(self.by_user),
+            "topics": len(self.by_topic),
+        }
+
+topic_map = TopicMap(chats_db)
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import signal
+from typing import Any, Mapping
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+
+# Логгер модуля; вывод настраивается в logging_setup
+logger = logging.getLogger(__name__)
+
+WEBHOOK_DEFAULTS = {
+    "url": "",
+    "host": "0.0.0.0",
+    "port": 8080,
+    "path": "/webhook",
+    "secret": "",
+}
+DRAIN_TIMEOUT = 30  # seconds
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def webhook_settings(config: Mapping[str, Any]) -> dict:
+    """Настройки вебхука из конфигурации с значениями по умолчанию"""
+    return {**WEBHOOK_DEFAULTS, **config.get("webhook", {})}
+
+class WebhookHandler:
+    """Принимает обновления по HTTP и передает их в диспетчер"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret: str):
+        if not secret:
+            raise ValueError("Секрет вебхука не задан")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self.draining = False
+        self.tasks: set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            logger.warning(f"Запрос с неверным секретом от {request.remote}")
+            return web.Response(status=401)
+        if self.draining:
+            # Telegram повторит доставку после перезапуска
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except (UnicodeDecodeError, ValueError):
+            # JSONDecodeError — подкласс ValueError
+            return web.Response(status=400)
+        task = asyncio.create_task(self._feed(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response()
+
+    async def _feed(self, update: dict):
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {str(e)}")
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Перестает принимать обновления и дожидается обработки начатых"""
+        self.draining = True
+        if self.tasks:
+            logger.info(f"Ожидание обработки {len(self.tasks)} обновлений")
+            done, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Не дождались обработки {len(pending)} обновлений")
+
+async def run_webhook(bot: Bot, dispatcher: Dispatcher, settings: Mapping[str, Any]):
+    """Запускает прием обновлений через вебхук до получения сигнала остановки"""
+    secret = settings["secret"]
+    if not secret:
+        if not settings["url"]:
+            # Вебхук зарегистрирован вручную: Telegram знает только настроенный секрет
+            raise RuntimeError("Для вебхука без url нужно задать webhook.secret в конфигурации")
+        secret = secrets.token_urlsafe(32)
+        logger.warning("webhook.secret не задан, для этого запуска создан случайный секрет")
+    webhook = WebhookHandler(dispatcher, bot, secret)
+    app = web.Application()
+    app.router.add_post(settings["path"], webhook.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings["host"], int(settings["port"]))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher)
+    try:
+        await site.start()
+        if settings["url"]:
+            await bot.set_webhook(
+                url=settings["url"],
+                secret_token=secret,
+                allowed_updates=dispatcher.resolve_used_update_types()
+            )
+        logger.info(f"Вебхук слушает {settings['host']}:{settings['port']}{settings['path']}")
+        await stop.wait()
+    finally:
+        await webhook.drain()
+        await runner.cleanup()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher)
+        logger.info("Вебхук остановлен")
+
+async def replay(path: str, url: str, secret: str):
+    """Отправляет записанные обновления (по одному JSON в строке) на локальный вебхук"""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with ClientSession() as session:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                async with session.post(url, data=line.encode("utf-8"), headers={
+                    **headers, "Content-Type": "application/json"
+                }) as response:
+                    print(f"{response.status} {json.loads(line).get('update_id')}")
+
+if __name__ == "__main__":
+    from load_config import get_config
+
+    settings = webhook_settings(get_config())
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на вебхук")
+    parser.add_argument("updates", help="файл с обновлениями, по одному JSON в строке")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{settings['port']}{settings['path']}")
+    args = parser.parse_args()
+    asyncio.run(replay(args.updates, args.url, settings["secret"]))